@@ -0,0 +1,297 @@
+#! /usr/bin/env python
+# Offline benchmarks for pyciv hot paths.
+#
+#   python benchmarks/run.py                      # all sizes, compare to baseline.json
+#   python benchmarks/run.py --sizes 20x12 50x30  # subset of board sizes
+#   python benchmarks/run.py --save-baseline      # overwrite baseline.json
+#   python benchmarks/run.py --check              # verify incremental state instead
+#
+# Each benchmark is timed over --repeat runs (best time is reported) and run
+# once more under tracemalloc for peak Python memory, each run on its own
+# clone of the fixture so none sees another's moves or warmed caches. Exits
+# non-zero if any benchmark is slower than the baseline by more than
+# --threshold. With --check, the incrementally maintained state the
+# benchmarks lean on is compared with a fresh build over a bot game with
+# random undos and redos, exiting non-zero on any mismatch.
+
+import contextlib
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+import numpy as np
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+from pyciv import mapmaker
+from pyciv import utils as civutils
+from pyciv.utils import Action
+from pyciv.game import Game
+from pyciv.influence import InfluenceMaps
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MAP_CONFIG = os.path.join(HERE, '..', 'map.ini')
+BASELINE = os.path.join(HERE, 'baseline.json')
+SIZES = [(20, 12), (50, 30), (100, 60), (200, 120), (400, 240)]
+SEED = 1234
+CIVS = ['France', 'America']
+LEADERS = ['Me', 'You']
+
+
+@contextlib.contextmanager
+def quiet():
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def open_tile(game, near, exclude=()):
+    # Closest free land tile to a position, for placing fixture units
+    tiles = [
+        t for t in game.board
+        if t.base != 'ocean' and not t.has_feature('mountain', 'ice')
+        and not game.get_unit(t) and not game.get_civ(t) and t.pos not in exclude
+    ]
+    return min(tiles, key=lambda t: civutils.distance(near, t.pos, game.shape[0]))
+
+
+def make_fixture(shape):
+    # Both civs settle their starting settler and get a worker, an archer and
+    # a fresh settler, so every benchmark has something to work on.
+    random.seed(SEED)
+    game = Game(shape, civs=CIVS, leaders=LEADERS, map_config_file=MAP_CONFIG, bots_only=True)
+    units = {}
+    for civ in game.civs:
+        settler = [u for u in civ.units if u._class == 'settler'][0]
+        pos = settler.pos
+        game.settle(settler)
+        city = civ.cities[0]
+        worker = game.add_unit(city.tiles[1], civ, 'worker' + civ.name, 'worker')
+        archer = game.add_unit(open_tile(game, pos), civ, 'archer' + civ.name, 'archer')
+        settler = game.add_unit(open_tile(game, pos), civ, 'settler' + civ.name, 'settler')
+        units[civ.name] = {'worker': worker, 'archer': archer, 'settler': settler}
+    return game, units
+
+
+def clone_fixture(game, units):
+    # Fresh copy of a fixture, with fresh bots and caches
+    out = game.clone(quiet=True)
+    new_units = {}
+    for civ, new_civ in zip(game.civs, out.civs):
+        index = {id(u): i for i, u in enumerate(civ.units)}
+        new_units[civ.name] = {k: new_civ.units[index[id(u)]] for k, u in units[civ.name].items()}
+    new_units['_grid'] = units['_grid']
+    return out, new_units
+
+
+def bench_mapmaker(shape, game, units):
+    random.seed(SEED)
+    mapmaker.make(shape, map_config_file=MAP_CONFIG)
+
+
+def bench_find_best_path(shape, game, units):
+    start = units['France']['archer'].pos
+    goal = game.civs[1].cities[0].pos
+    civutils.find_best_path(start, goal, game)
+
+
+def bench_get_moves(shape, game, units):
+    units['France']['archer'].get_moves(game)
+
+
+def bench_settler_scores(shape, game, units):
+    game.settler_scores(units['France']['settler'])
+
+
+def bench_worker_scores(shape, game, units):
+    game.worker_scores(units['France']['worker'])
+
+
+def bench_bot_get_action(shape, game, units):
+    random.seed(SEED)
+    game.bots['France'].get_action(game)
+
+
+def bench_end_turn(shape, game, units):
+    for _ in game.civs:
+        game.end_turn()
+
+
+def bench_render_draw(shape, game, units):
+    grid = units['_grid']
+    grid.draw()
+
+
+BENCHMARKS = [
+    ('mapmaker.make', bench_mapmaker),
+    ('utils.find_best_path', bench_find_best_path),
+    ('Unit.get_moves', bench_get_moves),
+    ('Game.settler_scores', bench_settler_scores),
+    ('Game.worker_scores', bench_worker_scores),
+    ('BasicBot.get_action', bench_bot_get_action),
+    ('Game.end_turn', bench_end_turn),
+    ('RenderGrid.draw', bench_render_draw),
+]
+
+
+def maps_match(a, b):
+    return (
+        all(np.array_equal(getattr(a, k), getattr(b, k)) for k in ('combat', 'civilian', 'city', 'occupant', 'combat_occupant'))
+        and np.allclose(a.threat, b.threat) and np.allclose(a.influence, b.influence)
+    )
+
+
+def check_influence(shape, game, units, steps=300, max_actions=100):
+    # Bot game on a clone, undoing and redoing actions at random (settling
+    # each civ's spare settler first, so a city is undone and refounded), with
+    # the incremental influence maps compared against fresh ones as it goes
+    random.seed(SEED)
+    game = game.clone(quiet=True)
+    settlers = [u for civ in game.civs for u in civ.units if u._class == 'settler']
+    actions = [Action('settle', unit=u) for u in settlers]
+    errors = []
+    n = 0
+    for step in range(steps):
+        if game.winner() is not None:
+            break
+        if actions:
+            action = actions.pop(0)
+        else:
+            n += 1
+            action = (game.get_bot_action() if n < max_actions else Action('end_turn'))
+        if action.name == 'end_turn':
+            n = 0
+        record = game.apply(action)
+        if random.random() < 0.3:
+            if random.random() < 0.5:
+                game.influence_maps()
+            game.undo(record)
+            if random.random() < 0.5 and not maps_match(game.influence_maps(), InfluenceMaps(game).sync(game)):
+                errors.append('step {}: {} undone'.format(step, action.name))
+            game.apply(action)
+            for bot in game.bots.values():
+                bot.reset()
+        if not maps_match(game.influence_maps(), InfluenceMaps(game).sync(game)):
+            errors.append('step {}: {}'.format(step, action.name))
+    return errors
+
+
+CHECKS = [
+    ('InfluenceMaps.sync', check_influence),
+]
+
+
+def check(sizes):
+    failures = 0
+    for shape in sizes:
+        key = '{}x{}'.format(*shape)
+        for name, func in CHECKS:
+            with quiet():
+                game, units = make_fixture(shape)
+                errors = func(shape, game, units)
+            print("{:>8} {:<22} {}".format(key, name, ('FAIL ' + '; '.join(errors[:3]) if errors else 'ok')), flush=True)
+            failures += bool(errors)
+    return failures
+
+
+def measure(func, shape, game, units, repeat):
+    times = []
+    for _ in range(repeat):
+        args = (shape,) + clone_fixture(game, units)
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    args = (shape,) + clone_fixture(game, units)
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'time': min(times), 'peak_kb': peak / 1024.}
+
+
+def run(sizes, names=None, repeat=3):
+    import pygame as pg
+    from pyciv.render import RenderGrid
+    pg.init()
+    results = {}
+    for shape in sizes:
+        key = '{}x{}'.format(*shape)
+        with quiet():
+            game, units = make_fixture(shape)
+        units['_grid'] = RenderGrid(game.board, game.civs, screen_size=(1920, 1080))
+        results[key] = {}
+        for name, func in BENCHMARKS:
+            if names and name not in names:
+                continue
+            with quiet():
+                results[key][name] = measure(func, shape, game, units, repeat)
+            r = results[key][name]
+            print("{:>8} {:<22} {:>10.4f}s {:>10.1f}kB".format(key, name, r['time'], r['peak_kb']), flush=True)
+    pg.quit()
+    return results
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    print("\n{:>8} {:<22} {:>10} {:>10} {:>7}".format('size', 'benchmark', 'time', 'baseline', 'ratio'))
+    for key, benches in results.items():
+        for name, r in benches.items():
+            base = baseline.get(key, {}).get(name)
+            if base is None:
+                print("{:>8} {:<22} {:>10.4f} {:>10} {:>7}".format(key, name, r['time'], '-', '-'))
+                continue
+            ratio = r['time'] / max(base['time'], 1e-9)
+            flag = ''
+            if ratio > threshold:
+                flag = ' REGRESSION'
+                regressions.append((key, name, ratio))
+            print("{:>8} {:<22} {:>10.4f} {:>10.4f} {:>6.2f}x{}".format(key, name, r['time'], base['time'], ratio, flag))
+    return regressions
+
+
+def main(argv):
+    parser = ArgumentParser()
+    parser.add_argument("--sizes", nargs="+", help="board sizes as WIDTHxHEIGHT (default: {})".format(
+        " ".join('{}x{}'.format(*s) for s in SIZES)))
+    parser.add_argument("--bench", nargs="+", help="only run these benchmarks")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", default=False, action="store_true")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="time ratio over baseline reported as a regression")
+    parser.add_argument("-o", "--output", help="write results as JSON")
+    parser.add_argument("--check", default=False, action="store_true",
+                        help="check incremental state against fresh builds instead of timing")
+    args = parser.parse_args(argv)
+    sizes = ([tuple(int(x) for x in s.split('x')) for s in args.sizes] if args.sizes else SIZES)
+    if args.check:
+        return (1 if check(sizes) else 0)
+    results = run(sizes, names=args.bench, repeat=args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        for key, benches in results.items():
+            baseline.setdefault(key, {}).update(benches)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        return 0
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("\n{} regression(s) over {:.2f}x baseline".format(len(regressions), args.threshold))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,127 @@
+import multiprocessing as mp
+import numpy as np
+
+from . import utils as civutils
+from .improvements import improvement_options
+
+
+class Snapshot:
+    # Compact, picklable copy of what per-civ bot analysis needs: per-tile
+    # arrays for the board plus unit and city positions, without any of the
+    # game's object graph.
+    def __init__(self, game):
+        board = game.board
+        shape = board.shape
+        self.shape = shape
+        self.turn = game.turn
+        self.civs = [civ.name for civ in game.civs]
+        self.moves = np.zeros(shape, dtype=np.int16)
+        self.yields = np.zeros(shape, dtype=np.int16)
+        self.resources = np.zeros(shape, dtype=bool)
+        self.improvable = np.zeros(shape, dtype=bool)
+        for tile in board:
+            pos = tile.pos
+            self.moves[pos] = tile.moves
+            self.yields[pos] = sum(tile.yields.values())
+            self.resources[pos] = bool(tile.resources)
+            self.improvable[pos] = bool(improvement_options(tile))
+        # Owner index as returned by Game.get_civ, i.e. the first civ listing
+        # the tile, and city centres as found by Game.get_city
+        self.owner = np.full(shape, -1, dtype=np.int8)
+        self.city = np.zeros(shape, dtype=bool)
+        for i in reversed(range(len(game.civs))):
+            for tile in game.civs[i].tiles():
+                self.owner[tile.pos] = i
+        for civ in game.civs:
+            for city in civ:
+                self.city[city.pos] = True
+        self.cities = [(self.civs.index(city.civ), city.pos) for civ in game.civs for city in civ]
+        self.units = [
+            (unit.name, self.civs.index(unit.civ), unit._type, unit.pos, unit.moves, unit.order is not None)
+            for civ in game.civs for unit in civ.units
+        ]
+        # Position -> (civ, type) of the unit Game.get_unit would return
+        self.unit_at = {pos: (self.civs.index(unit.civ), unit._type) for pos, unit in civutils.unit_map(game).items()}
+        self.signature = city_signature(game)
+
+    def settler_score(self, pos, civ):
+        return civutils.settler_score(pos, civ, self.shape, self._owner, self._is_city, self._yields, self._resources)
+
+    def worker_score(self, pos, civ):
+        return civutils.worker_score(pos, civ, self._owner, self._is_city, self._improvable, self._yields, self._resources)
+
+    def search(self, start, goals):
+        # utils.dijkstra on the arrays, stopping once every goal is reached
+        return civutils.dijkstra(start, self.shape, self._moves, self.unit_at, goals=goals)
+
+    # Per-position lookups for the rules in utils, as Game has
+
+    def _owner(self, pos):
+        owner = self.owner[pos]
+        return (int(owner) if owner != -1 else None)
+
+    def _is_city(self, pos):
+        return bool(self.city[pos])
+
+    def _yields(self, pos):
+        return int(self.yields[pos])
+
+    def _resources(self, pos):
+        return bool(self.resources[pos])
+
+    def _improvable(self, pos):
+        return bool(self.improvable[pos])
+
+    def _moves(self, pos):
+        return int(self.moves[pos])
+
+
+def city_signature(game):
+    # Changes whenever a city is founded, changes hands or grows its borders,
+    # which is what invalidates precomputed settler and worker scores
+    return tuple((city.civ, city.pos, len(city.tiles)) for civ in game.civs for city in civ)
+
+
+def analyze(args):
+    # Expensive per-turn analysis for one civ: settler scores around its
+    # settlers, worker scores on its tiles, and for each combat unit that can
+    # still be given an order the best path to every enemy city and unit.
+    snapshot, civ = args
+    out = {'civ': snapshot.civs[civ], 'signature': snapshot.signature, 'settler_scores': {}, 'worker_scores': {}, 'paths': {}}
+    enemies = [pos for c, pos in snapshot.cities if c != civ]
+    enemies += [u[3] for u in snapshot.units if u[1] != civ]
+    for name, c, _type, pos, moves, ordered in snapshot.units:
+        if c != civ:
+            continue
+        if _type == 'settler':
+            for p in [pos] + civutils.tiles_in_range(pos, 2, snapshot.shape):
+                if p not in out['settler_scores']:
+                    out['settler_scores'][p] = snapshot.settler_score(p, civ)
+        elif _type == 'combat' and enemies and moves > 0 and not ordered:
+            came_from, costs = snapshot.search(pos, enemies)
+            paths = {}
+            for goal in enemies:
+                path = civutils.trace_path(came_from, goal)
+                paths[goal] = (path, {p: costs[p] for p in path})
+            out['paths'][name] = (pos, moves, paths)
+    for pos in sorted(set(zip(*np.nonzero(snapshot.owner == civ)))):
+        pos = (int(pos[0]), int(pos[1]))
+        out['worker_scores'][pos] = snapshot.worker_score(pos, civ)
+    return out
+
+
+class AnalysisPool:
+    # Runs analyze for every bot civ in worker processes at the start of each
+    # round and hands the results to the bots, which still choose and apply
+    # their actions one civ at a time.
+    def __init__(self, processes=None):
+        self.pool = mp.Pool(processes=processes)
+
+    def run(self, game, civs):
+        snapshot = Snapshot(game)
+        args = [(snapshot, game.civs.index(civ)) for civ in civs]
+        return self.pool.map(analyze, args)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
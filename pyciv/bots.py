@@ -1,137 +1,771 @@
+import math
 import random
+import time
+import multiprocessing as mp
 import numpy as np
 from collections import Counter
 
 from . import YIELD_TYPES
 from . import utils as civutils
+from . import combat
+from .analysis import city_signature
 from .utils import Action
 from .buildings import BUILDINGS
 from .units import UNITS
 
 
 MAX_ITER = 10
+# Actions that cannot change tile ownership, features or improvements, so the
+# cached settler and worker score maps survive them
+SCORE_SAFE_ACTIONS = ['move', 'goto', 'fortify', 'range attack', 'build', 'end_turn']
+# Order in which units are deliberated over when planning, so the ones that
+# matter most still get full attention if the time budget runs out
+UNIT_PRIORITY = {'settler': 0, 'combat': 1, 'worker': 2}
+# Enemy threat above which civilians won't head for a tile. Threat sums
+# floats, so this also absorbs rounding left after units move away.
+DANGER_THRESHOLD = 1e-6
 
 
-class BasicBot:
+class TurnCache:
+    # Analysis shared by all of a civ's actors during one of its turns. Unit
+    # entries hold reachable tiles, attack targets and path searches, and are
+    # dropped when the unit moves or spends moves, or when an action lands
+    # within its reach. The attack table (see combat.attack_table) is dropped
+    # likewise when any of its attackers moves or spends moves, or an action
+    # lands within any of their ranges.
+    def __init__(self, key=None):
+        self.key = key
+        self.units = {}
+        self.attacks = None
+        self.settler_scores = {}
+        self.worker_scores = None
+        self.danger = None
+
+    def invalidate(self, positions, xsize):
+        for name, entry in list(self.units.items()):
+            if any(civutils.distance(entry['pos'], pos, xsize) <= entry['radius'] for pos in positions):
+                del self.units[name]
+        if self.attacks is not None:
+            for (a_pos, moves), radius in zip(self.attacks['keys'], self.attacks['radii']):
+                if any(civutils.distance(a_pos, pos, xsize) <= radius for pos in positions):
+                    self.attacks = None
+                    break
+
+    def reset_scores(self):
+        self.settler_scores = {}
+        self.worker_scores = None
+        self.danger = None
+
+
+def reservoir_sample(items):
+    # Uniform pick from an iterable without building a list, None if empty
+    out = None
+    for i, item in enumerate(items):
+        if random.randrange(i + 1) == 0:
+            out = item
+    return out
+
+
+class Bot:
+    # Base class handling the per-turn deliberation budget. time_budget is in
+    # seconds of get_action time per civ turn, None for no limit. Subclasses
+    # implement choose_action and check out_of_time() to fall back on cheap
+    # decisions once the budget is spent.
+    time_budget = None
+
     def __init__(self, civ, **kwargs):
         self.civ = civ
+        self.spent = 0.
+        self._budget_key = None
+        self._call_start = None
         for k, v in kwargs.items():
             setattr(self, k, v)
 
     def get_action(self, game):
-        civ = self.civ
+        self._call_start = time.perf_counter()
+        key = (game.turn, game.active)
+        if key != self._budget_key:
+            self._budget_key = key
+            self.spent = 0.
+        action = self.choose_action(game)
+        self.spent += time.perf_counter() - self._call_start
+        self._call_start = None
+        if action.name == 'end_turn' and self.time_budget is not None and self.spent > self.time_budget:
+            game.stats.add('bot_overrun', self.spent - self.time_budget)
+        return action
+
+    def choose_action(self, game):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def out_of_time(self):
+        if self.time_budget is None:
+            return False
+        elapsed = self.spent
+        if self._call_start is not None:
+            elapsed += time.perf_counter() - self._call_start
+        return elapsed >= self.time_budget
+
+
+class BasicBot(Bot):
+    # 'plan' picks one action per actor for the whole turn up front (see
+    # plan_turn), 'enumerate' rebuilds every actor's actions and picks one at
+    # random on each call, 'sample' picks an actor first and only generates
+    # that actor's actions (see sample_action).
+    mode = 'plan'
+    # Actor choice in 'sample' mode: 'weighted' by an estimate of each actor's
+    # action count, which stays close to 'enumerate', or 'uniform'
+    sampling = 'weighted'
+
+    def __init__(self, civ, **kwargs):
+        self.plan = []
+        self.cache = TurnCache()
+        self.analysis = None
+        self._last = None
+        super(BasicBot, self).__init__(civ, **kwargs)
+
+    def choose_action(self, game):
+        self.refresh(game)
+        if self.mode == 'enumerate':
+            action = self.enumerate_action(game)
+        elif self.mode == 'sample':
+            action = self.sample_action(game)
+        else:
+            action = self.next_planned_action(game)
+        return self.remember(action)
+
+    def reset(self):
+        # Forget everything cached, e.g. after the game was rewound with
+        # Game.undo
+        self.cache = TurnCache()
+        self.plan = []
+        self.analysis = None
+        self._last = None
+
+    def refresh(self, game):
+        # Start a new cache each turn, otherwise revalidate what the last
+        # action we handed out could have changed
+        key = (game.turn, game.active)
+        if self.cache.key != key:
+            self.cache = TurnCache(key)
+            self.plan = []
+            self.seed_cache(game)
+        elif self._last is not None:
+            action, pos = self._last
+            positions = [pos]
+            if action.unit is not None:
+                positions.append(action.unit.pos)
+            if hasattr(action.target, 'pos'):
+                positions.append(action.target.pos)
+            self.cache.invalidate([p for p in positions if p is not None], game.shape[0])
+            if action.name not in SCORE_SAFE_ACTIONS:
+                self.cache.reset_scores()
+        self._last = None
+
+    def seed_cache(self, game):
+        # Start from precomputed analysis (see analysis.analyze) where it still
+        # matches: paths for units that haven't moved or spent moves since the
+        # snapshot, and scores if no city has been founded, taken or grown
+        analysis, self.analysis = self.analysis, None
+        if analysis is None:
+            return
+        units = {unit.name: unit for unit in self.civ.units}
+        for name, (pos, moves, paths) in analysis['paths'].items():
+            unit = units.get(name)
+            if unit is not None and unit.pos == pos and unit.moves == moves:
+                self._entry(unit)['paths'].update(paths)
+        if analysis['signature'] == city_signature(game):
+            self.cache.settler_scores.update(analysis['settler_scores'])
+            self.cache.worker_scores = analysis['worker_scores']
+
+    def remember(self, action):
+        self._last = (action, (action.unit.pos if action.unit else None))
+        return action
+
+    def enumerate_action(self, game):
+        # Past the time budget, choose from whatever was found so far, or from
+        # every actor's cheap actions if nothing was
         actions = []
-        for city in civ.cities:
-            actions += self.city_actions(city, game)
-        for unit in civ.units:
-            if unit.moves > 0:
-                if unit._type == 'settler':
-                    actions += self.settler_actions(unit, game)
-                if unit._type == 'worker':
-                    actions += self.worker_actions(unit, game)
-                if unit._type == 'combat':
-                    actions += self.combat_actions(unit, game)
+        for actor in self.civ.cities + self.civ.units:
+            if self.out_of_time():
+                break
+            actions += self.actor_actions(actor, game)
+        if not actions and self.out_of_time():
+            for actor in self.civ.cities + self.civ.units:
+                actions += self.quick_actions(actor, game)
         if len(actions) > 0:
             action = random.choice(actions)
         else:
             action = Action('end_turn')
         return action
 
+    def sample_action(self, game):
+        actors = self.civ.cities + [unit for unit in self.civ.units if unit.moves > 0]
+        if self.sampling == 'weighted':
+            weights = [self.action_weight(actor, game) for actor in actors]
+            actors = [actor for actor, w in zip(actors, weights) if w > 0]
+            weights = [w for w in weights if w > 0]
+        else:
+            weights = None
+        while actors:
+            if weights:
+                i = random.choices(range(len(actors)), weights=weights)[0]
+            else:
+                i = random.randrange(len(actors))
+            if self.out_of_time():
+                action = reservoir_sample(self.quick_actions(actors[i], game))
+            else:
+                action = reservoir_sample(self.iter_actions(actors[i], game))
+            if action is not None:
+                return action
+            del actors[i]
+            if weights:
+                del weights[i]
+        return Action('end_turn')
+
+    def action_weight(self, actor, game):
+        # Cheap estimate of how many actions an actor has, without running its
+        # path searches
+        if actor in self.civ.cities:
+            n = len(actor.get_targets(game))
+            if actor.prod is None:
+                n += len(actor.prod_options())
+            return n
+        if actor._type == 'combat':
+            n_enemies = sum(len(civ.cities) + len(civ.units) for civ in game.civs if civ.name != actor.civ)
+            return 1 + len(self.unit_targets(actor, game)) + n_enemies
+        return 1
+
+    def iter_actions(self, actor, game):
+        if actor in self.civ.cities:
+            return self.iter_city_actions(actor, game)
+        return self.iter_unit_actions(actor, game)
+
+    def plan_turn(self, game):
+        # One action per city and per unit with moves left, units in random
+        # order within UNIT_PRIORITY. Units that still have moves after their
+        # action get planned again once this list runs out. Actors reached
+        # after the time budget is spent only get their cheap actions.
+        self.refresh(game)
+        plan = []
+        units = self.civ.units[:]
+        random.shuffle(units)
+        units.sort(key=lambda u: UNIT_PRIORITY.get(u._type, len(UNIT_PRIORITY)))
+        for actor in self.civ.cities + units:
+            actions = self.actor_actions(actor, game)
+            if actions:
+                plan.append(random.choice(actions))
+        return plan
+
+    def next_planned_action(self, game):
+        while self.plan:
+            action = self.revalidate(self.plan.pop(0), game)
+            if action is not None:
+                return action
+        self.plan = self.plan_turn(game)
+        if self.plan:
+            return self.plan.pop(0)
+        return Action('end_turn')
+
+    def revalidate(self, action, game):
+        # Earlier actions this turn may have spent the actor or its target, so
+        # keep the planned action only if the actor still has it, otherwise
+        # choose again from what the actor can do now
+        if action.city is not None:
+            if action.city not in self.civ.cities:
+                return None
+            actions = self.actor_actions(action.city, game)
+        else:
+            if action.unit not in self.civ.units:
+                return None
+            actions = self.actor_actions(action.unit, game)
+        for a in actions:
+            if a.name == action.name and a.target == action.target:
+                return a
+        if actions:
+            return random.choice(actions)
+
+    def actor_actions(self, actor, game):
+        if self.out_of_time():
+            return self.quick_actions(actor, game)
+        return list(self.iter_actions(actor, game))
+
+    def quick_actions(self, actor, game):
+        # Decisions that need no path searches or score maps: city actions,
+        # attacks on whatever is in range, fortifying, settling in place and
+        # building on the current tile
+        if actor in self.civ.cities:
+            return self.city_actions(actor, game)
+        unit = actor
+        if unit.moves <= 0 or unit.order is not None:
+            return []
+        if unit._type == 'combat':
+            attack_type = unit.attack + ' attack'
+            actions = [Action(attack_type, unit=unit, target=t) for t in self.unit_targets(unit, game)]
+            return actions or [Action('fortify', unit=unit)]
+        if unit._type == 'settler':
+            if self.settler_score(unit.pos, game) > 0:
+                return [Action('settle', unit=unit)]
+            return []
+        if unit._type == 'worker':
+            return [Action(a, unit=unit) for a in unit.build_actions(game)]
+        return []
+
+    def unit_actions(self, unit, game):
+        return list(self.iter_unit_actions(unit, game))
+
+    def iter_unit_actions(self, unit, game):
+        if unit.moves > 0:
+            if unit._type == 'settler':
+                return self.iter_settler_actions(unit, game)
+            if unit._type == 'worker':
+                return self.iter_worker_actions(unit, game)
+            if unit._type == 'combat':
+                return self.iter_combat_actions(unit, game)
+        return iter(())
+
+    def _entry(self, unit):
+        entry = self.cache.units.get(unit.name)
+        if entry is None or entry['pos'] != unit.pos or entry['moves'] != unit.moves:
+            entry = {
+                'pos': unit.pos,
+                'moves': unit.moves,
+                'radius': max(unit.movement, getattr(unit, 'range', 1)),
+                'paths': {}
+            }
+            self.cache.units[unit.name] = entry
+        return entry
+
+    def unit_moves(self, unit, game):
+        entry = self._entry(unit)
+        if 'move_tiles' not in entry:
+            entry['move_tiles'] = unit.get_moves(game)
+        return entry['move_tiles']
+
+    def unit_targets(self, unit, game):
+        entry = self._entry(unit)
+        if 'targets' not in entry:
+            entry['targets'] = unit.get_targets(game)
+        return entry['targets']
+
+    def unit_path(self, unit, goal, game, tree=False):
+        # Precomputed paths first, then the unit's full search tree if it has
+        # one or tree is asked for, otherwise a search that stops at goal
+        entry = self._entry(unit)
+        if goal in entry['paths']:
+            return entry['paths'][goal]
+        if tree or 'tree' in entry:
+            came_from, costs = self.unit_tree(unit, game)
+            return civutils.trace_path(came_from, goal), costs
+        entry['paths'][goal] = civutils.find_best_path(unit.pos, goal, game)
+        return entry['paths'][goal]
+
+    def unit_tree(self, unit, game):
+        entry = self._entry(unit)
+        if 'tree' not in entry:
+            entry['tree'] = civutils.find_paths(unit.pos, game)
+        return entry['tree']
+
+    def settler_score(self, pos, game):
+        scores = self.cache.settler_scores
+        if pos not in scores:
+            scores[pos] = game.settler_score(pos, self.civ)
+        return scores[pos]
+
+    def worker_scores(self, game):
+        # worker_score is zero outside the civ's own tiles
+        if self.cache.worker_scores is None:
+            scores = {}
+            for pos in sorted(set(t.pos for t in self.civ.tiles())):
+                scores[pos] = game.worker_score(pos, self.civ)
+            self.cache.worker_scores = scores
+        return self.cache.worker_scores
+
+    def danger(self, game):
+        # Tiles enemies can attack this turn, for keeping civilians out of
+        # harm's way (see influence.InfluenceMaps)
+        if self.cache.danger is None:
+            self.cache.danger = game.influence_maps().danger(self.civ.name) > DANGER_THRESHOLD
+        return self.cache.danger
+
     def city_actions(self, city, game):
-        actions = []
-        for target in city.get_targets(game):
-            actions.append(Action('range_attack', city=city, target=target))
+        return list(self.iter_city_actions(city, game))
+
+    def settler_actions(self, unit, game):
+        return list(self.iter_settler_actions(unit, game))
+
+    def worker_actions(self, unit, game):
+        return list(self.iter_worker_actions(unit, game))
+
+    def combat_actions(self, unit, game):
+        return list(self.iter_combat_actions(unit, game))
+
+    def iter_city_actions(self, city, game):
+        # Only the best range attack, which costs the city nothing
+        ranked = self.rank_attacks(city, game)
+        if ranked:
+            yield Action('range attack', city=city, target=ranked[0][1])
         if city.prod is None:
             for prod_opt in city.prod_options():
-                actions.append(Action('build', city=city, target=prod_opt))
-        return actions
+                yield Action('build', city=city, target=prod_opt)
 
-    def settler_actions(self, unit, game):
-        # By default, try to settle in place
-        if 'settle' in unit.actions(game):
-            actions = [Action('settle', unit=unit)]
-        else:
-            actions = []
-        # Move if we can find a better settling spot
+    def iter_settler_actions(self, unit, game):
+        # Head for a better settling spot, otherwise try to settle in place.
+        # A settler with a standing order keeps to it while its goal is still
+        # worth settling.
         pos = unit.pos
+        if unit.order is not None and self.settler_score(unit.order.goal, game) > 0:
+            return
         tile = game.board[pos]
-        moves = unit.get_moves(game)
         neighbors = civutils.neighbors(pos, game.board, 2)
         tiles = [tile] + neighbors
+        danger = self.danger(game)
         scores = {}
         for t in tiles:
-            score = game.settler_score(t.pos, game.find_civ(unit.civ))
+            if t.pos != pos and danger[t.pos]:
+                continue
+            score = self.settler_score(t.pos, game)
             if t.moves <= unit.movement and score > 0:
                 scores[t.pos] = score
         if scores:
             best = max(scores.keys(), key=lambda x: scores[x])
-            if best != pos:
-                path, costs = civutils.find_best_path(pos, best, game)
-                target = None
-                for i in range(1, len(path)):
-                    if costs[path[i]] <= unit.moves:
-                        target = game.board[path[i]]
-                    else:
-                        break
-                if target:
-                    actions = [Action('move', unit=unit, target=target)]
-        return actions
+            if best != pos and self.step_towards(unit, best, game):
+                path, costs = self.unit_path(unit, best, game)
+                yield Action('goto', unit=unit, target=game.board[best], path=path)
+                return
+        if unit.moves > 0 and self.settler_score(pos, game) > 0:
+            yield Action('settle', unit=unit)
 
-    def worker_actions(self, unit, game):
-        # By default, do something on current tile
-        actions = [Action(a, unit=unit) for a in unit.actions(game) if a != 'move']
+    def iter_worker_actions(self, unit, game):
+        # Head for the best tile to improve, otherwise do something on the
+        # current tile
         pos = unit.pos
-        tiles = game.board.tiles()
-        scores = {}
-        for t in tiles:
-            score = game.worker_score(t.pos, game.find_civ(unit.civ))
-            if t.moves <= unit.movement and score > 0:
-                scores[t.pos] = score
-        if scores:
-            best = max(scores.keys(), key=lambda x: scores[x])
-            if best != pos:
-                path, costs = civutils.find_best_path(pos, best, game)
-                target = None
-                for i in range(1, len(path)):
-                    if costs[path[i]] <= unit.moves:
-                        target = game.board[path[i]]
-                    else:
-                        break
-                if target:
-                    actions = [Action('move', unit=unit, target=target)]
-        return actions
+        scores = self.worker_scores(game)
+        if unit.order is not None and scores.get(unit.order.goal, 0) > 0:
+            return
+        danger = self.danger(game)
+        best_scores = {}
+        for p, score in scores.items():
+            if game.board[p].moves <= unit.movement and score > 0 and not danger[p]:
+                best_scores[p] = score
+        if best_scores:
+            best = max(best_scores.keys(), key=lambda x: best_scores[x])
+            if best != pos and self.step_towards(unit, best, game):
+                path, costs = self.unit_path(unit, best, game)
+                yield Action('goto', unit=unit, target=game.board[best], path=path)
+                return
+        for a in unit.build_actions(game):
+            yield Action(a, unit=unit)
 
-    def combat_actions(self, unit, game):
-        # By default, fortify
-        actions = [Action('fortify', unit=unit)]
-        tile = game.board[unit.pos]
+    def iter_combat_actions(self, unit, game):
+        # Take the best attack if it is expected to come out ahead (see
+        # combat.expected_damage), otherwise fortify, attack anything in range
+        # or head for a tile next to any enemy. Units already under orders
+        # only stop to attack.
         attack_type = unit.attack + ' attack'
-        target_tiles = unit.get_targets(game)
-        move_tiles = unit.get_moves(game)
-        if target_tiles:
-            weights = []
-            for target_tile in target_tiles:
-                target_unit = game.get_unit(target_tile)
-                target_city = game.get_city(target_tile)
-                if target_city or target_unit:
-                    actions.append(Action(attack_type, unit=unit, target=target_tile))
-        if move_tiles:
-            paths = []
-            for civ in game.civs:
-                if civ.name != unit.civ:
-                    targets = civ.cities + civ.units
-                    for t in targets:
-                        path, costs = civutils.find_best_path(unit.pos, t.pos, game)
-                        paths.append((path, costs))
-            if paths:
-                for path, costs in paths:
-                    target = None
-                    for i in range(1, len(path)):
-                        tile = game.board[path[i]]
-                        if costs[path[i]] <= unit.moves and tile in move_tiles:
-                            target = tile
-                        else:
-                            break
-                    if target:
-                        actions.append(Action('move', unit=unit, target=target))
-        return actions
+        ranked = self.rank_attacks(unit, game)
+        if ranked and ranked[0][0] > 0:
+            yield Action(attack_type, unit=unit, target=ranked[0][1])
+            return
+        if unit.order is None:
+            yield Action('fortify', unit=unit)
+        for value, target_tile in ranked:
+            yield Action(attack_type, unit=unit, target=target_tile)
+        if unit.order is not None:
+            return
+        targets = []
+        for civ in game.civs:
+            if civ.name != unit.civ:
+                targets += civ.cities + civ.units
+        if targets and self.unit_moves(unit, game):
+            for t in targets:
+                path, costs = self.unit_path(unit, t.pos, game, tree=True)
+                if len(path) > 2 and self.furthest_step(unit, path[:-1], costs, game):
+                    yield Action('goto', unit=unit, target=game.board[path[-2]], path=path[:-1])
+
+    def attack_table(self, game):
+        # combat.attack_table for the civ, built in one call the first time
+        # any actor asks and rebuilt once an attacker it holds has moved or
+        # spent moves since
+        table = self.cache.attacks
+        if table is not None and all((a.pos, a.moves) == k for a, k in zip(table['attackers'], table['keys'])):
+            return table
+        table = combat.attack_table(game, self.civ)
+        table['keys'] = [(a.pos, a.moves) for a in table['attackers']]
+        table['radii'] = [getattr(a, 'range', 1) for a in table['attackers']]
+        table['index'] = {id(a): i for i, a in enumerate(table['attackers'])}
+        self.cache.attacks = table
+        return table
+
+    def rank_attacks(self, attacker, game):
+        # (value, tile) for each target of attacker, best first, from its row
+        # of the attack table
+        table = self.attack_table(game)
+        i = table['index'].get(id(attacker))
+        if i is None:
+            return []
+        values = table['value'][i]
+        cols = np.nonzero(~np.isnan(values))[0]
+        order = cols[np.argsort(-values[cols], kind='stable')]
+        return [(values[j], table['targets'][j]) for j in order]
+
+    def step_towards(self, unit, goal, game, tree=False):
+        path, costs = self.unit_path(unit, goal, game, tree=tree)
+        return self.furthest_step(unit, path, costs, game)
+
+    def furthest_step(self, unit, path, costs, game):
+        # Furthest tile along path that the unit can move to this turn
+        move_tiles = self.unit_moves(unit, game)
+        target = None
+        for i in range(1, len(path)):
+            tile = game.board[path[i]]
+            if costs[path[i]] <= unit.moves and tile in move_tiles:
+                target = tile
+            else:
+                break
+        return target
+
+
+def action_key(action):
+    # Identifies an action by positions and classes rather than by object, so
+    # it still means the same thing in a clone or after the game is rewound
+    # and replayed (which renames newly built units)
+    city = (action.city.pos if action.city is not None else None)
+    unit = ((action.unit.pos, action.unit._class) if action.unit is not None else None)
+    target = getattr(action.target, 'pos', action.target)
+    return (action.name, city, unit, target)
+
+
+def find_action(key, game, civ):
+    # Inverse of action_key on game, None if the actor is gone
+    name, city_pos, unit_key, target = key
+    city = unit = None
+    if city_pos is not None:
+        city = game.get_city(game.board[city_pos])
+        if city is None or city.civ != civ.name:
+            return None
+    if unit_key is not None:
+        pos, _class = unit_key
+        for u in civ.units:
+            if u.pos == pos and u._class == _class:
+                unit = u
+                break
+        else:
+            return None
+    if type(target) is tuple:
+        target = game.board[target]
+    return Action(name, city=city, unit=unit, target=target)
+
+
+def evaluate(game, civ):
+    # Share of the civs' combined strength held by civ, 1 or 0 if the game
+    # is decided
+    winner = game.winner()
+    if winner is not None:
+        return float(winner.name == civ.name)
+    scores = {}
+    for c in game.civs:
+        score = 10 * len(c.cities) + c.totals['population']
+        for unit in c.units:
+            score += 2 + getattr(unit, 'hp', 0) / 50.
+        scores[c.name] = score
+    total = sum(scores.values())
+    return (scores[civ.name] / total if total > 0 else 0.)
+
+
+class Node:
+    # Search statistics for one game state: visits, and per action key its
+    # visits and total value
+    def __init__(self, keys):
+        self.n = 0
+        self.keys = keys
+        self.stats = {key: [0, 0.] for key in keys}
+
+    def select(self, exploration):
+        # UCT, trying each action once first
+        best, best_score = None, None
+        for key in self.keys:
+            n, w = self.stats[key]
+            if n == 0:
+                return key
+            score = w / n + exploration * math.sqrt(math.log(self.n) / n)
+            if best_score is None or score > best_score:
+                best, best_score = key, score
+        return best
+
+
+class Search:
+    # Monte Carlo tree search over civ's actions on a private clone of the
+    # game. Tree nodes are the states where civ is to act, stored in a
+    # transposition table by Game.state_hash so different action orders that
+    # reach the same state share statistics. Every other civ plays its
+    # BasicBot in between, and rollouts play BasicBots for every civ. The
+    # clone is rewound with Game.undo after each iteration.
+    def __init__(self, game, civ_name, max_depth=6, rollout_turns=2, max_actions=200, exploration=1.4):
+        self.game = game.clone(bot_options={}, quiet=True)
+        self.civ = self.game.find_civ(civ_name)
+        self.policy = BasicBot(self.civ)
+        self.max_depth = max_depth
+        self.rollout_turns = rollout_turns
+        self.max_actions = max_actions
+        self.exploration = exploration
+        self.table = {}
+        self.root = self.expand()
+
+    def expand(self):
+        self.policy.reset()
+        keys = [action_key(a) for actor in self.civ.cities + self.civ.units for a in self.policy.actor_actions(actor, self.game)]
+        keys = list(dict.fromkeys(keys))
+        random.shuffle(keys)
+        keys.append(action_key(Action('end_turn')))
+        node = Node(keys)
+        self.table[self.game.state_hash()] = node
+        return node
+
+    def run(self, iterations=None, deadline=None):
+        i = 0
+        while (iterations is None or i < iterations) and (deadline is None or time.perf_counter() < deadline):
+            self.iterate()
+            i += 1
+        return i
+
+    def iterate(self):
+        game = self.game
+        records = []
+        path = []
+        node = self.root
+        for _ in range(self.max_depth):
+            if game.winner() is not None:
+                break
+            key = node.select(self.exploration)
+            action = find_action(key, game, self.civ)
+            if action is None:
+                break
+            path.append((node, key))
+            records.append(game.apply(action))
+            self.play_others(records)
+            child = self.table.get(game.state_hash())
+            if child is None:
+                if game.winner() is None:
+                    self.expand()
+                break
+            node = child
+        value = self.rollout(records)
+        for node, key in path:
+            node.n += 1
+            node.stats[key][0] += 1
+            node.stats[key][1] += value
+        for record in reversed(records):
+            game.undo(record)
+
+    def play_others(self, records):
+        # Play the other civs until it is civ's turn again
+        game = self.game
+        for bot in game.bots.values():
+            bot.reset()
+        n = 0
+        while game.active_civ() is not self.civ and game.winner() is None:
+            n += 1
+            action = (game.get_bot_action() if n < self.max_actions else Action('end_turn'))
+            if action.name == 'end_turn':
+                n = 0
+            records.append(game.apply(action))
+
+    def rollout(self, records):
+        game = self.game
+        for bot in game.bots.values():
+            bot.reset()
+        end = game.turn + self.rollout_turns
+        n = 0
+        while game.turn < end and game.winner() is None:
+            n += 1
+            action = (game.get_bot_action() if n < self.max_actions else Action('end_turn'))
+            if action.name == 'end_turn':
+                n = 0
+            records.append(game.apply(action))
+        return evaluate(game, self.civ)
+
+    def root_stats(self):
+        return {key: tuple(self.root.stats[key]) for key in self.root.keys}
+
+
+def search_root(args):
+    # One independent search, for running root-parallel in worker processes
+    game, civ_name, iterations, seconds, seed, options = args
+    random.seed(seed)
+    search = Search(game, civ_name, **options)
+    deadline = (time.perf_counter() + seconds if seconds is not None else None)
+    search.run(iterations=iterations, deadline=deadline)
+    return search.root_stats()
+
+
+class MCTSBot(Bot):
+    # Picks each action by Monte Carlo tree search (see Search) with
+    # BasicBot as the rollout policy. Each decision gets iterations
+    # iterations, stopping early after move_time seconds or once the turn's
+    # time_budget runs out, after which it falls back on BasicBot. With
+    # processes, that many independent searches run in worker processes and
+    # their root statistics are summed.
+    iterations = 100
+    move_time = None
+    processes = None
+    max_depth = 6
+    rollout_turns = 2
+    exploration = 1.4
+
+    def __init__(self, civ, **kwargs):
+        self.fallback = BasicBot(civ)
+        self.pool = None
+        super(MCTSBot, self).__init__(civ, **kwargs)
+
+    def choose_action(self, game):
+        if self.out_of_time():
+            return self.fallback.choose_action(game)
+        options = {
+            'max_depth': self.max_depth,
+            'rollout_turns': self.rollout_turns,
+            'exploration': self.exploration
+        }
+        seconds = self.move_time
+        if self.time_budget is not None:
+            left = self.time_budget - self.spent - (time.perf_counter() - self._call_start)
+            seconds = (left if seconds is None else min(seconds, left))
+        search = Search(game, self.civ.name, **options)
+        if len(search.root.keys) == 1:
+            stats = search.root_stats()
+        elif self.processes:
+            if self.pool is None:
+                self.pool = mp.Pool(processes=self.processes)
+            iterations = int(math.ceil(self.iterations / float(self.processes)))
+            args = [(search.game, self.civ.name, iterations, seconds, random.random(), options) for _ in range(self.processes)]
+            stats = {}
+            for result in self.pool.map(search_root, args):
+                for key, (n, w) in result.items():
+                    total = stats.setdefault(key, [0, 0.])
+                    total[0] += n
+                    total[1] += w
+        else:
+            deadline = (time.perf_counter() + seconds if seconds is not None else None)
+            search.run(iterations=self.iterations, deadline=deadline)
+            stats = search.root_stats()
+        # Tell the fallback what we did, so its cache stays valid if it takes
+        # over later this turn
+        for key in sorted(stats, key=lambda k: stats[k][0], reverse=True):
+            action = find_action(key, game, self.civ)
+            if action is not None:
+                return self.fallback.remember(action)
+        return self.fallback.remember(Action('end_turn'))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+BOTS = {
+    'basic': BasicBot,
+    'mcts': MCTSBot
+}
@@ -37,6 +37,12 @@ class City(object):
     def pos(self):
         return self.tiles[0].x, self.tiles[0].y
 
+    def copy(self, board):
+        # Copy whose tiles are looked up on board, a copy of this city's board
+        out = civutils.copy_state(self)
+        out.tiles = [board[tile.pos] for tile in self.tiles]
+        return out
+
     def add_building(self, *args):
         for building in args:
             self.buildings.append(building)
@@ -82,12 +88,11 @@ class City(object):
         out = []
         if self.moves > 0:
             range_ = getattr(self, 'range', 1)
+            maps = game.influence_maps()
             for tile in civutils.neighbors(self.pos, game.board, range_):
-                target_unit = game.get_unit(tile)
-                target_city = game.get_city(tile)
-                if target_unit is not None:
-                    if target_unit.civ != self.civ and target_unit._type == 'combat':
-                        out.append(tile)
+                target_civ = maps.combat_civ(tile.pos)
+                if target_civ is not None and target_civ != self.civ:
+                    out.append(tile)
         return out
 
     def update_pp(self):
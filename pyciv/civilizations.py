@@ -1,6 +1,7 @@
 from .city import City
 from .units import create_unit
 from . import YIELD_TYPES
+from .utils import copy_state
 
 CIV_COLORS = {
     'France': 'red',
@@ -24,6 +25,14 @@ class Civilization(object):
         for city in self.cities:
             yield city
 
+    def copy(self, board):
+        # Copies cities and units; capital still points at the original city,
+        # which may belong to another civ by now (see Game.clone)
+        out = copy_state(self)
+        out.cities = [city.copy(board) for city in self.cities]
+        out.units = [unit.copy() for unit in self.units]
+        return out
+
     @property
     def yields(self):
         out = {y: 0 for y in YIELD_TYPES}
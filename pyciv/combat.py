@@ -0,0 +1,122 @@
+import numpy as np
+
+# Strength differences are clamped to [-MAX_DIFF, MAX_DIFF] (see
+# utils.calc_damage), and the damage curve is sampled RESOLUTION times per
+# unit of difference in that range
+MAX_DIFF = 100
+RESOLUTION = 100
+DIFFS = np.linspace(-MAX_DIFF, MAX_DIFF, 2 * MAX_DIFF * RESOLUTION + 1)
+DAMAGE_CURVE = 30 * 1.041 ** DIFFS
+# Bonuses in attack values for kills and captures, and the penalty for losing
+# the attacker
+KILL_VALUE = 100
+CAPTURE_VALUE = 200
+
+
+def damage(diff, melee):
+    # utils.calc_damage over arrays of strength differences, by lookup in
+    # DAMAGE_CURVE. Returns damage dealt and damage taken.
+    diff = np.clip(np.asarray(diff, dtype=float), -MAX_DIFF, MAX_DIFF)
+    i = np.rint((diff + MAX_DIFF) * RESOLUTION).astype(int)
+    dealt = np.minimum(100, np.floor(DAMAGE_CURVE[i]))
+    taken = np.where(melee, np.minimum(100, np.floor(DAMAGE_CURVE[len(DAMAGE_CURVE) - 1 - i])), 0)
+    return dealt, taken
+
+
+def defenders(game, targets):
+    # Per target tile: defense against units (the city with any combat
+    # garrison, or else the unit), defense against cities (units only), the
+    # defender's hp, whether it is a city or a civilian, and the city's owner
+    n = len(targets)
+    out = {
+        'strength': np.zeros(n),
+        'unit_strength': np.zeros(n),
+        'hp': np.zeros(n),
+        'city': np.zeros(n, dtype=bool),
+        'civilian': np.zeros(n, dtype=bool),
+        'city_civ': np.full(n, None, dtype=object)
+    }
+    for j, tile in enumerate(targets):
+        city = game.get_city(tile)
+        unit = game.get_unit(tile)
+        if unit is not None and unit._type == 'combat':
+            out['unit_strength'][j] = unit.def_strength(tile)
+        if city is not None:
+            out['strength'][j] = city.def_strength(tile) + out['unit_strength'][j]
+            out['hp'][j] = city.hp
+            out['city'][j] = True
+            out['city_civ'][j] = city.civ
+        elif unit is not None and unit._type == 'combat':
+            out['strength'][j] = out['unit_strength'][j]
+            out['hp'][j] = unit.hp
+        else:
+            out['civilian'][j] = True
+    return out
+
+
+def expected_damage(game, attackers, targets, mask=None):
+    # Outcome of every attacker (combat units or cities) attacking every
+    # target tile, mirroring Game.combat_action and Game.city_action. Returns
+    # (attackers x targets) matrices of damage dealt and taken and an attack
+    # value, NaN where mask is False. mask defaults to each attacker's
+    # get_targets.
+    n, m = len(attackers), len(targets)
+    out = {'dealt': np.full((n, m), np.nan), 'taken': np.full((n, m), np.nan), 'value': np.full((n, m), np.nan)}
+    if n == 0 or m == 0:
+        return out
+    if mask is None:
+        mask = np.zeros((n, m), dtype=bool)
+        index = {tile.pos: j for j, tile in enumerate(targets)}
+        for i, attacker in enumerate(attackers):
+            for tile in attacker.get_targets(game):
+                if tile.pos in index:
+                    mask[i, index[tile.pos]] = True
+    mask = np.asarray(mask, dtype=bool)
+    strength = np.array([a.atk_strength(game.board[a.pos]) for a in attackers])
+    hp = np.array([a.hp for a in attackers], dtype=float)
+    is_city = np.array([not hasattr(a, '_type') for a in attackers])
+    melee = np.array([getattr(a, 'attack', 'range') == 'melee' for a in attackers])
+    d = defenders(game, targets)
+    defense = np.where(is_city[:, None], d['unit_strength'][None, :], d['strength'][None, :])
+    melee = np.broadcast_to(melee[:, None], (n, m))
+    dealt, taken = damage(strength[:, None] - defense, melee)
+    target_hp = np.broadcast_to(d['hp'][None, :], (n, m))
+    target_city = np.broadcast_to(d['city'][None, :] & ~is_city[:, None], (n, m))
+    civilian = np.broadcast_to(d['civilian'][None, :], (n, m))
+    death = taken >= hp[:, None]
+    value = dealt - taken - KILL_VALUE * death
+    value += KILL_VALUE * ((dealt >= target_hp) & ~target_city & ~civilian)
+    value += CAPTURE_VALUE * (target_city & melee & (dealt >= target_hp) & ~death)
+    # A melee attack on a city with no hp left takes it outright, and
+    # civilians are killed without a fight
+    taken_city = target_city & melee & (target_hp <= 0)
+    for arr, v in ((dealt, 0), (taken, 0), (value, CAPTURE_VALUE)):
+        arr[taken_city] = v
+    dealt[civilian] = 0
+    taken[civilian] = 0
+    value[civilian] = KILL_VALUE
+    # Unit attacks into the attacker's own cities do nothing
+    civs = np.array([a.civ for a in attackers], dtype=object)
+    own_city = target_city & (d['city_civ'][None, :] == civs[:, None])
+    for arr in (dealt, taken, value):
+        arr[own_city] = 0
+    for k, arr in (('dealt', dealt), ('taken', taken), ('value', value)):
+        out[k][mask] = arr[mask]
+    return out
+
+
+def attack_table(game, civ):
+    # expected_damage for every combat unit and city of civ that can still
+    # attack, against every target in range of any of them
+    attackers = [unit for unit in civ.units if unit._type == 'combat' and unit.moves > 0] + [city for city in civ if city.moves > 0]
+    targets = []
+    seen = set()
+    for attacker in attackers:
+        for tile in attacker.get_targets(game):
+            if tile.pos not in seen:
+                seen.add(tile.pos)
+                targets.append(tile)
+    out = expected_damage(game, attackers, targets)
+    out['attackers'] = attackers
+    out['targets'] = targets
+    return out
@@ -1,3 +1,4 @@
+import bisect
 import random
 import time
 import numpy as np
@@ -8,21 +9,73 @@ from . import bots as civbots
 from .utils import Action
 from .civilizations import Civilization
 from .city import City
+from .tile import Tile
 from .buildings import Building
-from .units import Unit
+from .units import Unit, Order
 from .improvements import improvement_options
+from .instrument import Stats, NULL_STATS
+from .analysis import AnalysisPool
+from . import zobrist
+from .influence import InfluenceMaps
 
 MAX_ITER = 1000
 MIN_CITY_SEP = 4
 MAP_ATTEMPTS = 10
+# Entries kept in Game.tile_log; past this the older half is dropped
+MAX_TILE_LOG = 10000
+
+
+class UndoRecord:
+    # What Game.apply needs to take an action back: the turn counters and a
+    # shallow copy of the attributes of every object the action could change
+    def __init__(self, game, action):
+        self.action = action
+        self.turn = game.turn
+        self.active = game.active
+        self.zobrist = game.zobrist
+        self.saved = {}
+
+    def save(self, *objs):
+        for obj in objs:
+            if obj is not None and id(obj) not in self.saved:
+                self.saved[id(obj)] = (obj, civutils.copy_state(obj).__dict__)
+
+    def restore(self, game):
+        # Fresh list copies each time, so a record can be restored more than once
+        for obj, state in self.saved.values():
+            obj.__dict__.clear()
+            for k, v in state.items():
+                obj.__dict__[k] = (v[:] if type(v) is list else v)
+            if isinstance(obj, Tile):
+                game.touch_tiles([obj])
+        game.turn = self.turn
+        game.active = self.active
+        game.zobrist = self.zobrist
 
 
 class Game:
 
-    def __init__(self, shape, civs, leaders, map_config_file=None, bots_only=False):
+    def __init__(self, shape, civs, leaders, map_config_file=None, bots_only=False, instrument=False, bot_options=None, bot_processes=None):
         self.shape = shape
+        self.stats = (Stats() if instrument else NULL_STATS)
+        # Worker processes for precomputing bot analysis each round (see
+        # analysis.AnalysisPool), 0 or None to analyse inline
+        self.bot_processes = bot_processes
+        self.bot_options = bot_options or {}
+        # Skip event messages, e.g. in search rollouts (see log)
+        self.quiet = False
+        self.zobrist = 0
+        self._rehash_depth = 0
+        # (tile_version, pos) of the tiles mutators touched, oldest first,
+        # for redrawing only those (see changed_tiles)
+        self.tile_version = 0
+        self.tile_log = []
+        self._tile_log_floor = 0
+        self._influence = None
+        self._analysis_pool = None
+        self._analysis_turn = None
         self.civs = [Civilization(civ, leaders) for civ in civs]
-        self._init_bot()
+        self._init_bot(**self.bot_options)
         if bots_only:
             self.humans = []
         else:
@@ -31,11 +84,14 @@ class Game:
         self._init_civs()
         self.turn = 0
         self.active = 0
+        # Incremental 64-bit hash of the game state, kept up to date by every
+        # mutator through rehash (see zobrist.Rehash)
+        self.zobrist = zobrist.full_hash(self)
 
-    def _init_bot(self):
+    def _init_bot(self, bot='basic', **kwargs):
         bots = {}
         for civ in self.civs:
-            bots[civ.name] = civbots.BasicBot(civ)
+            bots[civ.name] = civbots.BOTS[bot](civ, **kwargs)
         self.bots = bots
 
     def _init_map(self, map_config_file=None):
@@ -70,13 +126,27 @@ class Game:
                 i += 1
 
     def step(self, action):
+        with self.stats.timer('step'):
+            self._step(action)
+
+    def _step(self, action):
         if action.city and action.target:
-            self.city_action(action.city, action.target, action.name)
+            if action.name == 'build':
+                self.city_action(action.city, action.target, action.name)
+            else:
+                with self.stats.timer('combat'):
+                    self.city_action(action.city, action.target, action.name)
         elif action.unit:
-            if action.name == 'move':
+            if action.name != 'goto' and action.unit.order is not None:
+                with self.rehash(units=[action.unit]):
+                    action.unit.order = None
+            if action.name == 'goto':
+                self.set_order(action.unit, action.target, path=action.path)
+            elif action.name == 'move':
                 self.move_unit(action.unit, action.target)
             elif action.unit._type == 'combat':
-                self.combat_action(action.unit, action.target, action.name)
+                with self.stats.timer('combat'):
+                    self.combat_action(action.unit, action.target, action.name)
             elif action.unit._type == 'worker':
                 self.worker_action(action.unit, action.name)
             elif action.name == 'settle':
@@ -85,9 +155,122 @@ class Game:
             self.end_turn()
         return
 
+    def apply(self, action):
+        # step, returning an UndoRecord that undo can take the action back with
+        record = UndoRecord(self, action)
+        record.save(*self.touched(action))
+        self.step(action)
+        return record
+
+    def undo(self, record):
+        record.restore(self)
+
+    def touched(self, action):
+        # Every object step(action) can change, bar the new cities and units
+        # it creates, which only enter the game through civ lists saved here
+        if action.name == 'end_turn':
+            for civ in self.civs:
+                yield civ
+                for city in civ:
+                    yield city
+                for unit in civ.units:
+                    yield unit
+                    yield unit.order
+        elif action.city:
+            yield action.city
+            if action.name != 'build':
+                for civ in self.civs:
+                    yield civ
+                for unit in self.get_units(action.target):
+                    yield unit
+        elif action.unit:
+            unit = action.unit
+            tile = self.board[unit.pos]
+            yield unit
+            yield unit.order
+            yield self.find_civ(unit.civ)
+            if unit._type == 'worker' and action.name not in ['move', 'goto']:
+                yield tile
+                yield self.get_city(tile, any_tile=True)
+            elif action.name == 'settle':
+                yield tile
+            elif unit._type == 'combat' and action.name not in ['move', 'goto']:
+                for civ in self.civs:
+                    yield civ
+                if action.target is not None:
+                    yield self.get_city(action.target)
+                    for target_unit in self.get_units(action.target):
+                        yield target_unit
+
+    def state_hash(self):
+        return self.zobrist
+
+    def influence_maps(self):
+        # Threat, influence and occupancy maps, brought up to date
+        if self._influence is None:
+            self._influence = InfluenceMaps(self)
+        return self._influence.sync(self)
+
+    def rehash(self, **scope):
+        return zobrist.Rehash(self, **scope)
+
+    def touch_tiles(self, tiles):
+        self.tile_version += 1
+        for tile in tiles:
+            self.tile_log.append((self.tile_version, tile.pos))
+        if len(self.tile_log) > MAX_TILE_LOG:
+            half = len(self.tile_log) // 2
+            self._tile_log_floor = self.tile_log[half - 1][0]
+            del self.tile_log[:half]
+
+    def changed_tiles(self, since):
+        # Positions of the tiles touched after tile_version was since, or None
+        # if the log no longer reaches back that far
+        if since < self._tile_log_floor:
+            return None
+        i = bisect.bisect_left(self.tile_log, (since + 1,))
+        return list(set(pos for v, pos in self.tile_log[i:]))
+
+    def clone(self, bot_options=None, quiet=None):
+        # Independent copy of the game state for lookahead, with fresh bots
+        # (built from bot_options if given) and no instrumentation or analysis
+        # pool
+        out = Game.__new__(Game)
+        out.__dict__ = self.__dict__.copy()
+        out.stats = NULL_STATS
+        out.bot_processes = None
+        out._analysis_pool = None
+        out._analysis_turn = None
+        out._influence = None
+        out.tile_log = self.tile_log[:]
+        out.humans = self.humans[:]
+        out.board = self.board.copy_tiles()
+        out.civs = [civ.copy(out.board) for civ in self.civs]
+        cities = {}
+        for civ, new_civ in zip(self.civs, out.civs):
+            for city, new_city in zip(civ.cities, new_civ.cities):
+                cities[id(city)] = new_city
+        for new_civ in out.civs:
+            if new_civ.capital is not None:
+                new_civ.capital = cities.get(id(new_civ.capital))
+        if bot_options is not None:
+            out.bot_options = bot_options
+        if quiet is not None:
+            out.quiet = quiet
+        out._init_bot(**out.bot_options)
+        return out
+
     def active_civ(self):
         return self.civs[self.active]
 
+    def alive_civs(self):
+        return [civ for civ in self.civs if civ.cities or civ.units]
+
+    def winner(self):
+        alive = self.alive_civs()
+        if len(alive) == 1:
+            return alive[0]
+
     def find_civ(self, name):
         for civ in self.civs:
             if civ.name == name:
@@ -134,30 +317,108 @@ class Game:
                     return unit
 
     def add_city(self, tile, civ, name, **kwargs):
+        with self.rehash(civs=[civ], tiles=[tile]):
+            return self._add_city(tile, civ, name, **kwargs)
+
+    def _add_city(self, tile, civ, name, **kwargs):
         tile.remove_features(*['forest', 'rainforest'])
         tiles = [tile] + self.board.get_neighbors(tile)
         city = civ.add_city(tiles, name, **kwargs)
         return city
 
     def add_unit(self, tile, civ, name, _class, **kwargs):
+        with self.rehash(civs=[civ]):
+            return self._add_unit(tile, civ, name, _class, **kwargs)
+
+    def _add_unit(self, tile, civ, name, _class, **kwargs):
         unit = civ.add_unit(tile, name, _class, **kwargs)
         return unit
 
     def change_civ(self, city, new_civ):
+        with self.rehash(cities=[city]):
+            self._change_civ(city, new_civ)
+
+    def _change_civ(self, city, new_civ):
         old_civ = self.find_civ(city.civ)
         city.reassign(new_civ.name)
         new_civ.append_city(city)
         old_civ.remove_city(city)
 
     def move_unit(self, unit, tile):
-        if tile in unit.get_moves(self):
-            path, costs = civutils.find_best_path(unit.pos, tile.pos, self)
+        with self.rehash(units=[unit]):
+            self._move_unit(unit, tile)
+
+    def _move_unit(self, unit, tile):
+        came_from, costs = civutils.find_paths(unit.pos, self, max_cost=unit.moves)
+        if tile in unit.get_moves(self, costs=costs):
             unit.move(tile.pos, costs[tile.pos])
         else:
-            print("invalid move ({},{})".format(*tile.pos))
+            self.log("invalid move ({},{})", *tile.pos)
         return
 
+    def log(self, msg, *args):
+        # Game event messages, skipped without formatting when quiet
+        if not self.quiet:
+            print(msg.format(*args))
+
+    def gain_exp(self, unit, exp):
+        if unit.update_exp(exp):
+            self.log("{} leveled up", unit.name)
+
+    def set_order(self, unit, tile, path=None):
+        with self.rehash(units=[unit]):
+            self._set_order(unit, tile, path=path)
+
+    def _set_order(self, unit, tile, path=None):
+        # path, if given, is a best path from the unit to tile, e.g. the one
+        # the bot chose the order from
+        if not path or path[0] != unit.pos or path[-1] != tile.pos:
+            path, costs = civutils.find_best_path(unit.pos, tile.pos, self)
+        unit.order = Order(tile.pos, path[1:])
+        self.follow_order(unit)
+
+    def follow_order(self, unit):
+        with self.rehash(units=[unit]):
+            self._follow_order(unit)
+
+    def _follow_order(self, unit):
+        # Walk the cached path as far as this turn's moves allow. A blocked
+        # step gets one re-plan to the same goal, after which the order is
+        # dropped, as it is when the goal itself can no longer be entered.
+        order = unit.order
+        replanned = False
+        while order.path and unit.moves > 0:
+            tile = self.board[order.path[0]]
+            if not unit.can_enter(tile, self):
+                if replanned or not unit.can_enter(self.board[order.goal], self):
+                    unit.order = None
+                    return
+                path, costs = civutils.find_best_path(unit.pos, order.goal, self)
+                order.path = path[1:]
+                replanned = True
+            elif unit.moves >= tile.moves:
+                unit.move(tile.pos, tile.moves)
+                order.path.pop(0)
+            else:
+                break
+        if not order.path:
+            unit.order = None
+
+    def follow_orders(self, civ):
+        with self.rehash(civs=[civ]):
+            self._follow_orders(civ)
+
+    def _follow_orders(self, civ):
+        with self.stats.timer('orders'):
+            for unit in civ.units[:]:
+                if unit.order is not None:
+                    self.follow_order(unit)
+
     def settle(self, unit):
+        with self.rehash(civs=[self.find_civ(unit.civ)], tiles=[self.board[unit.pos]]):
+            self._settle(unit)
+
+    def _settle(self, unit):
         tile = self.board[unit.pos]
         civ = self.find_civ(unit.civ)
         name = 'city' + civutils.random_str(8)
@@ -167,32 +428,33 @@ class Game:
         return
 
     def settler_score(self, pos, civ):
-        tile = self.board[pos]
-        tile_civ = self.get_civ(tile)
-        occupied = (tile_civ and (tile_civ != civ))
-        near_city = any(self.get_city(nb) for nb in civutils.neighbors(pos, self.board, r=3))
-        if occupied or near_city:
-            return 0
-        else:
-            total = sum(tile.yields.values())
-            for nb in civutils.neighbors(pos, self.board, r=1):
-                if self.get_civ(nb):
-                    total += 0
-                elif nb.resources:
-                    total += 2 * sum(nb.yields.values())
-                else:
-                    total += sum(nb.yields.values())
-            return total
+        # Timed per call only when instrumented, as even NULL_STATS timers
+        # cost a lot at one call per tile; settler_scores times whole passes
+        if self.stats.enabled:
+            with self.stats.timer('settler_scoring'):
+                return self._settler_score(pos, civ)
+        return self._settler_score(pos, civ)
+
+    def _settler_score(self, pos, civ):
+        return civutils.settler_score(
+            pos, civ, self.shape, self._tile_owner, self._tile_is_city, self._tile_yields, self._tile_resources
+        )
 
     def settler_scores(self, settler):
         out = np.zeros_like(self.board)
-        for i in range(out.shape[0]):
-            for j in range(out.shape[1]):
-                pos = (i, j)
-                out[pos] = self.settler_score(pos, self.find_civ(settler.civ))
+        civ = self.find_civ(settler.civ)
+        with self.stats.timer('settler_scoring'):
+            for i in range(out.shape[0]):
+                for j in range(out.shape[1]):
+                    pos = (i, j)
+                    out[pos] = self._settler_score(pos, civ)
         return out
 
     def worker_action(self, unit, action):
+        with self.rehash(units=[unit], tiles=[self.board[unit.pos]], cities=[self.get_city(self.board[unit.pos], any_tile=True)]):
+            self._worker_action(unit, action)
+
+    def _worker_action(self, unit, action):
         tile = self.board[unit.pos]
         if action == 'chop':
             if 'forest' in tile.features:
@@ -212,25 +474,48 @@ class Game:
         return
 
     def worker_score(self, pos, civ):
-        tile = self.board[pos]
-        tile_civ = self.get_civ(tile)
-        if tile_civ == civ and not self.get_city(tile) and improvement_options(tile):
-            if tile.resources:
-                return 2 * sum(tile.yields.values())
-            else:
-                return sum(tile.yields.values())
-        else:
-            return 0
+        if self.stats.enabled:
+            with self.stats.timer('worker_scoring'):
+                return self._worker_score(pos, civ)
+        return self._worker_score(pos, civ)
+
+    def _worker_score(self, pos, civ):
+        return civutils.worker_score(
+            pos, civ, self._tile_owner, self._tile_is_city, self._tile_improvable, self._tile_yields, self._tile_resources
+        )
+
+    # Per-position lookups for the scoring rules in utils
+
+    def _tile_owner(self, pos):
+        return self.get_civ(self.board[pos])
+
+    def _tile_is_city(self, pos):
+        return self.get_city(self.board[pos]) is not None
+
+    def _tile_yields(self, pos):
+        return sum(self.board[pos].yields.values())
+
+    def _tile_resources(self, pos):
+        return bool(self.board[pos].resources)
+
+    def _tile_improvable(self, pos):
+        return bool(improvement_options(self.board[pos]))
 
     def worker_scores(self, worker):
         out = np.zeros_like(self.board)
-        for i in range(out.shape[0]):
-            for j in range(out.shape[1]):
-                pos = (i, j)
-                out[pos] = self.worker_score(pos, self.find_civ(worker.civ))
+        civ = self.find_civ(worker.civ)
+        with self.stats.timer('worker_scoring'):
+            for i in range(out.shape[0]):
+                for j in range(out.shape[1]):
+                    pos = (i, j)
+                    out[pos] = self._worker_score(pos, civ)
         return out
 
     def combat_action(self, unit, target_tile, action):
+        with self.rehash(units=[unit] + self.get_units(target_tile), cities=[self.get_city(target_tile)]):
+            self._combat_action(unit, target_tile, action)
+
+    def _combat_action(self, unit, target_tile, action):
         unit_tile = self.board[unit.pos]
         civ = self.find_civ(unit.civ)
         target_city = self.get_city(target_tile)
@@ -241,13 +526,13 @@ class Game:
                 if civ != target_civ:
                     unit.unfortify()
                     if action == 'melee attack' and target_city.hp == 0:
-                        print("{} ({}) took over {} ({})".format(unit._class, civ.name, target_city.name, target_civ.name))
+                        self.log("{} ({}) took over {} ({})", unit._class, civ.name, target_city.name, target_civ.name)
                         self.change_civ(target_city, civ)
                         if target_unit:
                             target_civ.remove_unit(target_unit)
                         self.move_unit(unit, target_tile)
                         unit.move(unit.pos, unit.moves)
-                        unit.update_exp(2)
+                        self.gain_exp(unit, 2)
                         target_city.update_hp(50)
                     else:
                         atk_dmg, def_dmg = civutils.calc_city_damage(unit, target_city, unit_tile, target_tile, action, garrison=target_unit)
@@ -257,23 +542,23 @@ class Game:
                         target_hp = target_city.hp
                         if action == 'melee attack':
                             if hp > 0 and target_hp <= 0:
-                                print("{} ({}) took over {} ({})".format(unit._class, civ.name, target_city.name, target_civ.name))
+                                self.log("{} ({}) took over {} ({})", unit._class, civ.name, target_city.name, target_civ.name)
                                 self.change_civ(target_city, civ)
                                 if target_unit:
                                     target_civ.remove_unit(target_unit)
                                 self.move_unit(unit, target_tile)
                                 unit.move(unit.pos, unit.moves)
-                                unit.update_exp(2)
+                                self.gain_exp(unit, 2)
                                 target_city.update_hp(50)
                             elif hp <= 0 and target_hp > 0:
-                                print("{} ({}) died while attacking {} ({})".format(unit._class, civ.name, target_city.name, target_civ.name))
+                                self.log("{} ({}) died while attacking {} ({})", unit._class, civ.name, target_city.name, target_civ.name)
                                 civ.remove_unit(unit)
                             else:
                                 unit.move(unit.pos, unit.moves)
-                                unit.update_exp(2)
+                                self.gain_exp(unit, 2)
                         elif action == 'range attack':
                             unit.move(unit.pos, unit.moves)
-                            unit.update_exp(1)
+                            self.gain_exp(unit, 1)
             elif target_unit:
                 target_unit_type = type(target_unit).__name__
                 target_civ = self.find_civ(target_unit.civ)
@@ -281,34 +566,34 @@ class Game:
                     unit.unfortify()
                     if target_unit_type == 'CombatUnit':
                         atk_dmg, def_dmg = civutils.calc_unit_damage(unit, target_unit, unit_tile, target_tile, action)
-                        print("{} ({}) did {} damage to {} ({})".format(unit._class, civ.name, atk_dmg, target_unit._class, target_civ.name))
-                        print("{} ({}) did {} damage to {} ({})".format(target_unit._class, target_civ.name, def_dmg, unit._class, civ.name))
+                        self.log("{} ({}) did {} damage to {} ({})", unit._class, civ.name, atk_dmg, target_unit._class, target_civ.name)
+                        self.log("{} ({}) did {} damage to {} ({})", target_unit._class, target_civ.name, def_dmg, unit._class, civ.name)
                         target_unit.damage(atk_dmg)
                         unit.damage(def_dmg)
                         hp = unit.hp
                         target_hp = target_unit.hp
                         if hp > 0 and target_hp <= 0:
-                            print("{} ({}) killed {} ({})".format(unit._class, civ.name, target_unit._class, target_civ.name))
+                            self.log("{} ({}) killed {} ({})", unit._class, civ.name, target_unit._class, target_civ.name)
                             target_civ.remove_unit(target_unit)
                             if action == 'melee attack':
                                 unit.move(target_tile.pos, target_tile.moves)
                             else:
                                 unit.move(unit.pos, 1)
-                            unit.update_exp(2)
+                            self.gain_exp(unit, 2)
                         elif hp <= 0 and target_hp > 0:
-                            print("{} ({}) died while attacking {} ({})".format(unit._class, civ.name, target_unit._class, target_civ.name))
+                            self.log("{} ({}) died while attacking {} ({})", unit._class, civ.name, target_unit._class, target_civ.name)
                             civ.remove_unit(unit)
-                            target_unit.update_exp(1)
+                            self.gain_exp(target_unit, 1)
                         elif hp <= 0 and target_hp <= 0:
-                            print("{} ({}) and {} ({}) died fighting".format(unit._class, civ.name, target_unit._class, target_civ.name))
+                            self.log("{} ({}) and {} ({}) died fighting", unit._class, civ.name, target_unit._class, target_civ.name)
                             civ.remove_unit(unit)
                             target_civ.remove_unit(target_unit)
                         else:
-                            target_unit.update_exp(1)
+                            self.gain_exp(target_unit, 1)
                             unit.move(unit.pos, 1)
-                            unit.update_exp(2)
+                            self.gain_exp(unit, 2)
                     elif target_unit_type in ['WorkerUnit', 'SettlerUnit']:
-                        print("{} ({}) killed {} ({})".format(unit._class, civ.name, target_unit._class, target_civ.name))
+                        self.log("{} ({}) killed {} ({})", unit._class, civ.name, target_unit._class, target_civ.name)
                         target_civ.remove_unit(target_unit)
                         if action == 'melee attack':
                             unit.move(target_tile.pos, target_tile.moves)
@@ -318,6 +603,10 @@ class Game:
         return
 
     def city_action(self, city, target, action):
+        with self.rehash(cities=[city], units=(self.get_units(target) if action != 'build' else [])):
+            self._city_action(city, target, action)
+
+    def _city_action(self, city, target, action):
         if action == 'build':
             city.begin_prod(target)
         elif action == 'range attack':
@@ -328,50 +617,81 @@ class Game:
             target_civ = self.find_civ(target_unit.civ)
             if civ != target_civ and target_unit._type == 'combat':
                 atk_dmg, def_dmg = civutils.calc_unit_damage(city, target_unit, city_tile, target, action)
-                print("city ({}) did {} damage to {} ({})".format(civ.name, atk_dmg, target_unit._class, target_civ.name))
+                self.log("city ({}) did {} damage to {} ({})", civ.name, atk_dmg, target_unit._class, target_civ.name)
                 target_unit.damage(atk_dmg)
                 target_hp = target_unit.hp
                 if target_hp <= 0:
-                    print("city ({}) killed {} ({})".format(civ.name, target_unit._class, target_civ.name))
+                    self.log("city ({}) killed {} ({})", civ.name, target_unit._class, target_civ.name)
                     target_civ.remove_unit(target_unit)
                 else:
-                    target_unit.update_exp(1)
+                    self.gain_exp(target_unit, 1)
                 city.set_moves(0)
 
     def end_turn(self):
+        with self.rehash(civs=self.civs, counters=True):
+            self._end_turn()
+
+    def _end_turn(self):
         civ = self.active_civ()
-        for city in civ:
-            new_item = city.update_prod()
-            if new_item:
-                if isinstance(new_item, Building):
-                    city.add_building(new_item)
-                elif isinstance(new_item, Unit):
-                    unit = new_item
-                    for tile in city:
-                        if not self.get_unit(tile):
-                            self.add_unit(tile, civ, unit.name, unit._class)
-                            break
-            city.update_pp()
-            city.update_tiles(self)
-            civ.update_totals(city.yields)
-            city.update_hp()
-            city.set_moves(1)
-        units = civ.units
-        for unit in units:
-            unit.end_turn(self)
-            if unit._class == 'worker':
-                if unit.builds == 0:
-                    civ.remove_unit(unit)
+        with self.stats.timer('city_updates'):
+            for city in civ:
+                new_item = city.update_prod()
+                if new_item:
+                    if isinstance(new_item, Building):
+                        city.add_building(new_item)
+                    elif isinstance(new_item, Unit):
+                        unit = new_item
+                        for tile in city:
+                            if not self.get_unit(tile):
+                                self.add_unit(tile, civ, unit.name, unit._class)
+                                break
+                city.update_pp()
+                city.update_tiles(self)
+                civ.update_totals(city.yields)
+                city.update_hp()
+                city.set_moves(1)
+        with self.stats.timer('unit_updates'):
+            units = civ.units
+            for unit in units:
+                unit.end_turn(self)
+                if unit._class == 'worker':
+                    if unit.builds == 0:
+                        civ.remove_unit(unit)
+        self.stats.end_turn(self.turn, civ.name)
         self.active += 1
         if self.active >= len(self.civs):
             self.active = 0
             self.turn += 1
+        self.follow_orders(self.active_civ())
 
     def cpu_turn(self):
         self.ai[self.active_civ().name].play(self)
         self.end_turn()
 
+    def analyze_bots(self):
+        # Once a round, analyse every bot civ in parallel from one snapshot
+        self._analysis_turn = self.turn
+        civs = [civ for civ in self.civs if civ.name not in self.humans and civ.units]
+        if not civs:
+            return
+        if self._analysis_pool is None:
+            self._analysis_pool = AnalysisPool(self.bot_processes)
+        with self.stats.timer('analysis'):
+            results = self._analysis_pool.run(self, civs)
+        for result in results:
+            self.bots[result['civ']].analysis = result
+
+    def close(self):
+        for bot in self.bots.values():
+            bot.close()
+        if self._analysis_pool is not None:
+            self._analysis_pool.close()
+            self._analysis_pool = None
+
     def get_bot_action(self):
+        if self.bot_processes and self._analysis_turn != self.turn:
+            self.analyze_bots()
         bot = self.bots[self.active_civ().name]
-        action = bot.get_action(self)
+        with self.stats.timer('bot'):
+            action = bot.get_action(self)
         return action
\ No newline at end of file
@@ -0,0 +1,148 @@
+import numpy as np
+
+from . import utils as civutils
+
+_stencils = {}
+
+
+def stencil(r, parity):
+    # (dx, dy) offsets of every hex within r steps of a tile on a row of the
+    # given parity, itself included
+    k = (r, parity)
+    if k not in _stencils:
+        start = (0, parity)
+        seen = {start}
+        frontier = [start]
+        for _ in range(r):
+            new = []
+            for pos in frontier:
+                for n in range(6):
+                    nb = civutils.neighbor(pos, n, 1 << 30)
+                    if nb not in seen:
+                        seen.add(nb)
+                        new.append(nb)
+            frontier = new
+        offsets = np.array(sorted(seen))
+        offsets[:, 0] = np.where(offsets[:, 0] > (1 << 29), offsets[:, 0] - (1 << 30) - 1, offsets[:, 0])
+        offsets[:, 1] -= parity
+        _stencils[k] = (offsets[:, 0], offsets[:, 1])
+    return _stencils[k]
+
+
+def dilate(pos, r, shape):
+    # Index arrays of the tiles within r of pos, wrapping in x
+    dx, dy = stencil(r, pos[1] % 2)
+    xs = (pos[0] + dx) % shape[0]
+    ys = pos[1] + dy
+    keep = (ys >= 0) & (ys < shape[1])
+    return xs[keep], ys[keep]
+
+
+class InfluenceMaps:
+    # Per civ (indexed as in game.civs):
+    #   threat: summed attack strength of the civ's combat units and cities
+    #       that can reach each tile this turn, i.e. within movement plus
+    #       range of a unit, or range of a city
+    #   influence: summed strength of the civ's units within their movement,
+    #       and of its cities within their range (civilians count 1)
+    # plus which civ get_unit/get_city would say holds each tile, so target
+    # queries are lookups: occupant (-1 for none) and combat_occupant, the
+    # civ of the combat unit there, if any.
+    # Kept in step with the game by sync, which restamps only the units and
+    # cities that moved, spawned, died or changed hands or strength since the
+    # last sync, and is skipped while game.zobrist is unchanged.
+    def __init__(self, game):
+        shape = game.shape
+        n = len(game.civs)
+        self.shape = shape
+        self.civ_names = [civ.name for civ in game.civs]
+        self.threat = np.zeros((n,) + tuple(shape))
+        self.influence = np.zeros((n,) + tuple(shape))
+        self.combat = np.zeros((n,) + tuple(shape), dtype=np.int16)
+        self.civilian = np.zeros((n,) + tuple(shape), dtype=np.int16)
+        self.city = np.zeros((n,) + tuple(shape), dtype=np.int16)
+        self.occupant = np.full(shape, -1, dtype=np.int8)
+        self.combat_occupant = np.full(shape, -1, dtype=np.int8)
+        self.stamps = {}
+        self.synced = None
+
+    def sync(self, game):
+        if self.synced == game.zobrist:
+            return self
+        board = game.board
+        seen = set()
+        dirty = set()
+        for i, civ in enumerate(game.civs):
+            for unit in civ.units:
+                if unit._type == 'combat':
+                    radius = unit.movement + getattr(unit, 'range', 1)
+                    stamp = (i, 'combat', unit.pos, unit.atk_strength(board[unit.pos]), radius, unit.strength, unit.movement)
+                else:
+                    stamp = (i, 'civilian', unit.pos, 0, 0, 1, unit.movement)
+                self.restamp(unit, stamp, seen, dirty)
+            for city in civ:
+                stamp = (i, 'city', city.pos, city.range_strength * board[city.pos].attack_modifier(), city.range, city.strength, city.range)
+                self.restamp(city, stamp, seen, dirty)
+        for k in [k for k in self.stamps if k not in seen]:
+            obj, stamp = self.stamps.pop(k)
+            self.apply(stamp, -1)
+            dirty.add(stamp[2])
+        for pos in dirty:
+            self.update_occupant(pos)
+        self.synced = game.zobrist
+        return self
+
+    def restamp(self, obj, stamp, seen, dirty):
+        k = id(obj)
+        seen.add(k)
+        old = self.stamps.get(k)
+        if old is not None and old[1] == stamp:
+            return
+        if old is not None:
+            self.apply(old[1], -1)
+            dirty.add(old[1][2])
+        self.apply(stamp, 1)
+        dirty.add(stamp[2])
+        # The object is kept so its id can't be reused while stamped
+        self.stamps[k] = (obj, stamp)
+
+    def apply(self, stamp, sign):
+        i, kind, pos, attack, reach, strength, movement = stamp
+        # Occupancy is counted, like units, so a settle undone while the
+        # stamp of the city it replays is still live leaves the tile held
+        if kind == 'city':
+            self.city[i][pos] += sign
+        elif kind == 'combat':
+            self.combat[i][pos] += sign
+        else:
+            self.civilian[i][pos] += sign
+        if attack:
+            np.add.at(self.threat[i], dilate(pos, reach, self.shape), sign * attack)
+        np.add.at(self.influence[i], dilate(pos, movement, self.shape), sign * strength)
+
+    def update_occupant(self, pos):
+        # Mirrors Game.get_unit (first civ's combat unit, else first civ's
+        # unit) falling back on Game.get_city
+        combat = np.nonzero(self.combat[(slice(None),) + pos] > 0)[0]
+        civilian = np.nonzero(self.civilian[(slice(None),) + pos] > 0)[0]
+        city = np.nonzero(self.city[(slice(None),) + pos] > 0)[0]
+        self.combat_occupant[pos] = (combat[0] if len(combat) else -1)
+        if len(combat):
+            self.occupant[pos] = combat[0]
+        elif len(civilian):
+            self.occupant[pos] = civilian[0]
+        else:
+            self.occupant[pos] = (city[0] if len(city) else -1)
+
+    def danger(self, civ_name):
+        # Summed threat of every other civ
+        i = self.civ_names.index(civ_name)
+        return self.threat.sum(axis=0) - self.threat[i]
+
+    def occupant_civ(self, pos):
+        i = self.occupant[pos]
+        return (self.civ_names[i] if i >= 0 else None)
+
+    def combat_civ(self, pos):
+        i = self.combat_occupant[pos]
+        return (self.civ_names[i] if i >= 0 else None)
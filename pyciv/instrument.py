@@ -0,0 +1,125 @@
+import json
+import time
+
+# Timing categories used by Game and utils. Categories nest (pathfinding runs
+# inside move enumeration, which runs inside bot decisions), so times are
+# inclusive and do not add up to the step total. 'bot_overrun' counts civ
+# turns where a bot went over its time budget, and by how much in total.
+CATEGORIES = [
+    'step',
+    'bot',
+    'pathfinding',
+    'moves',
+    'settler_scoring',
+    'worker_scoring',
+    'combat',
+    'city_updates',
+    'unit_updates',
+    'orders',
+    'analysis',
+    'bot_overrun'
+]
+
+
+class NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class NullStats:
+    # Stand-in used when instrumentation is off: every timer is the same
+    # no-op context manager, so the disabled cost is one method call.
+    enabled = False
+
+    def timer(self, category):
+        return NULL_TIMER
+
+    def add(self, category, elapsed, calls=1):
+        pass
+
+    def count(self, category, n=1):
+        pass
+
+    def end_turn(self, turn, civ):
+        pass
+
+
+NULL_STATS = NullStats()
+
+
+class Timer:
+    __slots__ = ('stats', 'category', 'start')
+
+    def __init__(self, stats, category):
+        self.stats = stats
+        self.category = category
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.add(self.category, time.perf_counter() - self.start)
+        return False
+
+
+class Stats:
+    enabled = True
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.totals = {}
+        self.current = {}
+        self.history = []
+
+    def timer(self, category):
+        return Timer(self, category)
+
+    def add(self, category, elapsed, calls=1):
+        for counters in (self.totals, self.current):
+            entry = counters.get(category)
+            if entry is None:
+                counters[category] = [elapsed, calls]
+            else:
+                entry[0] += elapsed
+                entry[1] += calls
+
+    def count(self, category, n=1):
+        self.add(category, 0., calls=n)
+
+    def end_turn(self, turn, civ):
+        self.history.append({'turn': turn, 'civ': civ, 'stats': self._as_dict(self.current)})
+        self.current = {}
+
+    def time(self, category):
+        return self.totals.get(category, [0., 0])[0]
+
+    def calls(self, category):
+        return self.totals.get(category, [0., 0])[1]
+
+    def summary(self):
+        return self._as_dict(self.totals)
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            for record in self.history:
+                f.write(json.dumps(record) + '\n')
+
+    def report(self):
+        lines = ["{:<16} {:>10} {:>10} {:>12}".format('category', 'time (s)', 'calls', 'per call (ms)')]
+        for category, (elapsed, calls) in sorted(self.totals.items(), key=lambda x: -x[1][0]):
+            per_call = (1000 * elapsed / calls if calls else 0)
+            lines.append("{:<16} {:>10.4f} {:>10d} {:>12.4f}".format(category, elapsed, calls, per_call))
+        return "\n".join(lines)
+
+    @staticmethod
+    def _as_dict(counters):
+        return {k: {'time': v[0], 'calls': v[1]} for k, v in counters.items()}
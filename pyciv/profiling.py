@@ -0,0 +1,104 @@
+import contextlib
+import cProfile
+import os
+import pstats
+import random
+
+from .game import Game
+from . import simulate
+
+CIVS = ['France', 'America']
+LEADERS = ['Me', 'You']
+MIN_STACK_TIME = 1e-6
+
+
+def profile_game(shape, turns, seed=None, map_config_file=None, quiet=True):
+    # Only the turns are profiled, map generation and setup are not
+    if seed is not None:
+        random.seed(seed)
+    profiler = cProfile.Profile()
+    with contextlib.ExitStack() as stack:
+        if quiet:
+            devnull = stack.enter_context(open(os.devnull, 'w'))
+            stack.enter_context(contextlib.redirect_stdout(devnull))
+        game = Game(shape, civs=CIVS, leaders=LEADERS, map_config_file=map_config_file, bots_only=True)
+        profiler.enable()
+        result = simulate.run(game, max_turns=turns)
+        profiler.disable()
+    return pstats.Stats(profiler), result
+
+
+def frame_label(func):
+    filename, line, name = func
+    if filename == '~':
+        return name
+    return "{}:{}:{}".format(os.path.basename(filename), name, line)
+
+
+def collapse(stats):
+    # cProfile only records caller -> callee edges, not full stacks, so each
+    # edge's share of the callee's cumulative time is used to split the
+    # callee's time between the stacks that lead to it.
+    callees = {}
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+    roots = [func for func, v in stats.stats.items() if not v[4]]
+    out = {}
+
+    def walk(func, stack, weight):
+        tt, ct = stats.stats[func][2:4]
+        stack = stack + [frame_label(func)]
+        self_time = tt * weight
+        if self_time >= MIN_STACK_TIME:
+            key = ";".join(stack)
+            out[key] = out.get(key, 0) + self_time
+        for callee, edge_ct in callees.get(func, []):
+            callee_ct = stats.stats[callee][3]
+            if callee_ct <= 0 or frame_label(callee) in stack:
+                continue
+            callee_weight = weight * min(1., edge_ct / callee_ct)
+            if callee_ct * callee_weight >= MIN_STACK_TIME:
+                walk(callee, stack, callee_weight)
+
+    for root in roots:
+        walk(root, [], 1.)
+    return out
+
+
+def write_collapsed(stats, path):
+    # One "frame;frame;frame count" line per stack, in microseconds, as read
+    # by flamegraph.pl, speedscope and inferno
+    with open(path, 'w') as f:
+        for stack, seconds in sorted(collapse(stats).items()):
+            count = int(round(seconds * 1e6))
+            if count > 0:
+                f.write("{} {}\n".format(stack, count))
+
+
+def module_name(filename):
+    parts = os.path.normpath(filename).split(os.sep)
+    if 'pyciv' in parts[:-1]:
+        i = len(parts) - 1 - parts[::-1].index('pyciv')
+        return '.'.join(parts[i:])[:-len('.py')]
+
+
+def module_summary(stats, top=20):
+    modules = {}
+    functions = []
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        module = module_name(func[0])
+        if module is None:
+            continue
+        entry = modules.setdefault(module, [0., 0])
+        entry[0] += tt
+        entry[1] += nc
+        functions.append((tt, ct, nc, module, func[2]))
+    lines = ["{:<24} {:>10} {:>12}".format('module', 'tottime', 'calls')]
+    for module, (tt, nc) in sorted(modules.items(), key=lambda x: -x[1][0])[:top]:
+        lines.append("{:<24} {:>10.3f} {:>12d}".format(module, tt, nc))
+    lines.append("")
+    lines.append("{:<40} {:>10} {:>10} {:>12}".format('function', 'tottime', 'cumtime', 'calls'))
+    for tt, ct, nc, module, name in sorted(functions, reverse=True)[:top]:
+        lines.append("{:<40} {:>10.3f} {:>10.3f} {:>12d}".format(module + '.' + name, tt, ct, nc))
+    return "\n".join(lines)
@@ -2,9 +2,12 @@
 
 import pygame as pg
 import math
+import numpy as np
 import os
 import sys
 import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from matplotlib.colors import to_rgb
 
 from . import menu_data
@@ -19,6 +22,29 @@ from .utils import Action
 SQRT3 = math.sqrt(3)
 
 TILE_INFO_DELAY = 0.2
+# Shade over tiles left out of a highlight
+HIGHLIGHT_SHADE = pg.Color(0, 0, 0, 80)
+# Margin around a hex's bounding box covering outlines drawn on its edges
+HEX_MARGIN = 3
+# Past this many dirty hexes a frame redraws their bounding box as one rect
+MAX_DIRTY_RECTS = 100
+# Pixel memory kept by a TextCache before it drops the least recently used
+TEXT_CACHE_BYTES = 16 * 1024 * 1024
+# Hex radius multiplies by this from one zoom level to the next
+ZOOM_STEP = 1.5
+# Hex radius in pixels past which there are no more zoom levels
+MAX_RADIUS = 60
+# Boards whose hexes would be smaller than this to fit the screen start
+# zoomed in
+MIN_START_RADIUS = 8
+# Terrain is cached per zoom level in square chunks of this many pixels, up
+# to MAX_CHUNKS of them
+CHUNK_SIZE = 256
+MAX_CHUNKS = 256
+# Pixels the camera moves per frame while an arrow key is held
+PAN_SPEED = 20
+# Width of the minimap panel in pixels
+MINIMAP_WIDTH = 300
 
 
 def colorname2pg(name):
@@ -26,151 +52,584 @@ def colorname2pg(name):
     return pg.Color(*rgb)
 
 
+class TextCache:
+    # Rendered text surfaces keyed by (string, color, font), dropping the least
+    # recently used once they hold more than max_bytes of pixels
+    def __init__(self, max_bytes=TEXT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.surfaces = OrderedDict()
+
+    def render(self, font, text, color=(255, 255, 255)):
+        key = (text, tuple(color), font)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            return surface
+        surface = font.render(text, 1, color)
+        self.surfaces[key] = surface
+        self.nbytes += self._size(surface)
+        while self.nbytes > self.max_bytes and len(self.surfaces) > 1:
+            _, old = self.surfaces.popitem(last=False)
+            self.nbytes -= self._size(old)
+        return surface
+
+    @staticmethod
+    def _size(surface):
+        return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+
 class RenderGrid(pg.Surface):
-    def __init__(self, board, civs, screen_size=(1280, 720)):
+    # Composites the part of the board under the camera from cached layers:
+    # terrain (bases, outlines and features), pieced together from chunks
+    # drawn once per zoom level and patched per tile when a tile changes,
+    # then transparent overlays for highlights, civs, paths and text, each
+    # redrawn only when its key changes (see layer). Only the hexes where
+    # some layer changed are recomposited, and only hexes in the viewport are
+    # ever drawn.
+    def __init__(self, board, civs, screen_size=(1280, 720), text_cache=None):
         self.board = board
         self.civs = civs
+        self.text_cache = (TextCache() if text_cache is None else text_cache)
         self.width, self.height = screen_size
-        self.radius = self._radius()
         super(RenderGrid, self).__init__((self.width, self.height))
+        self.base_colors = {base: colorname2pg(color) for base, color in BASE_COLORS.items()}
+        self.feature_colors = {feature: colorname2pg(color) for feature, color in FEATURE_COLORS.items()}
+        self.civ_colors = {civ: colorname2pg(color) for civ, color in CIV_COLORS.items()}
+        fit = self._radius()
+        self.zoom_levels = [fit]
+        while self.zoom_levels[-1] * ZOOM_STEP <= MAX_RADIUS:
+            self.zoom_levels.append(self.zoom_levels[-1] * ZOOM_STEP)
+        self.zoom_level = 0
+        while self.zoom_level < len(self.zoom_levels) - 1 and self.zoom_levels[self.zoom_level] < MIN_START_RADIUS:
+            self.zoom_level += 1
+        self.camera = (0, 0)
+        self.terrain = None
+        self.chunks = OrderedDict()
+        self.layers = {}
+        # Base and features of every tile as last seen by update_terrain
+        self._tile_keys = {tile.pos: (tile.base, tuple(tile.features)) for tile in board}
+        self._text_key = None
+        self._shown = []
+        self._dirty = set()
+        self._full = True
+        self.set_radius(self.zoom_levels[self.zoom_level])
 
     def _radius(self):
         max_x = self.width / (self.board.shape[0] + 0.5) / SQRT3
         max_y = self.height / (1.5 * self.board.shape[1] + 0.5)
         return min(max_x, max_y)
 
+    def set_radius(self, radius):
+        # Corner points of every hex on the board in world pixels (relative
+        # to the board's top left rather than the camera), indexed
+        # [x, y, corner]
+        self.radius = radius
+        x, y = np.meshgrid(np.arange(self.board.shape[0]), np.arange(self.board.shape[1]), indexing='ij')
+        offsets = np.stack([SQRT3 * radius * (x + 0.5 * (y % 2)), 1.5 * radius * y], axis=-1)
+        corners = radius * np.array([
+            (0.5 * SQRT3, 0),
+            (SQRT3, 0.5),
+            (SQRT3, 1.5),
+            (0.5 * SQRT3, 2),
+            (0, 1.5),
+            (0, 0.5)
+        ])
+        # pygame truncates coordinates towards zero. Flooring them instead
+        # (as for circles and triangles) draws a hex the same wherever it
+        # lands relative to the surface, e.g. across terrain chunks.
+        self.vertices = np.floor(offsets[:, :, None, :] + corners)
+        self._set_view()
+
+    def world_size(self):
+        return (
+            SQRT3 * self.radius * (self.board.shape[0] + 0.5),
+            self.radius * (1.5 * self.board.shape[1] + 0.5)
+        )
+
+    def set_camera(self, x, y):
+        # Move the viewport's top left to world pixel (x, y), kept over the
+        # board. The layers are drawn for the old view, so everything is
+        # redrawn.
+        world_w, world_h = self.world_size()
+        x = int(round(min(max(x, 0), max(world_w - self.width, 0))))
+        y = int(round(min(max(y, 0), max(world_h - self.height, 0))))
+        if (x, y) != self.camera:
+            self.camera = (x, y)
+            self._set_view()
+
+    def pan(self, dx, dy):
+        self.set_camera(self.camera[0] + dx, self.camera[1] + dy)
+
+    def zoom(self, steps, anchor):
+        # Change zoom level by steps, keeping the world point under the
+        # anchor pixel in place
+        level = min(max(self.zoom_level + steps, 0), len(self.zoom_levels) - 1)
+        if level == self.zoom_level:
+            return
+        scale = self.zoom_levels[level] / self.radius
+        world = ((self.camera[0] + anchor[0]) * scale, (self.camera[1] + anchor[1]) * scale)
+        self.zoom_level = level
+        self.set_radius(self.zoom_levels[level])
+        self.set_camera(world[0] - anchor[0], world[1] - anchor[1])
+
+    def center_on(self, pos):
+        x_offset, y_offset = self._xy_offset(*pos)
+        self.pan(x_offset + 0.5 * SQRT3 * self.radius - 0.5 * self.width, y_offset + self.radius - 0.5 * self.height)
+
+    def _set_view(self):
+        # Positions in the viewport, and drop everything drawn for the old one
+        self._view = self.cell_ranges(self.get_rect())
+        self.terrain = None
+        self.layers = {}
+        self._shown = []
+        self._dirty = set()
+        self._full = True
+
+    def cell_ranges(self, rect):
+        # Column and row ranges of the hexes overlapping a rect on the grid
+        # surface, with their outlines
+        r = self.radius
+        left = rect.left + self.camera[0] - HEX_MARGIN
+        top = rect.top + self.camera[1] - HEX_MARGIN
+        right = rect.right + self.camera[0] + HEX_MARGIN
+        bottom = rect.bottom + self.camera[1] + HEX_MARGIN
+        xs = range(
+            max(int(math.floor(left / (SQRT3 * r))) - 1, 0),
+            min(int(math.ceil(right / (SQRT3 * r))) + 1, self.board.shape[0])
+        )
+        ys = range(
+            max(int(math.floor((top - 2 * r) / (1.5 * r))), 0),
+            min(int(math.ceil(bottom / (1.5 * r))) + 1, self.board.shape[1])
+        )
+        return xs, ys
+
+    def cells_in(self, rect):
+        xs, ys = self.cell_ranges(rect)
+        return [(x, y) for x in xs for y in ys]
+
+    def in_view(self, pos):
+        return pos[0] in self._view[0] and pos[1] in self._view[1]
+
+    def visible(self):
+        xs, ys = self._view
+        return [(x, y) for x in xs for y in ys]
+
+    @contextmanager
+    def _viewing(self, camera):
+        # Draw as if the camera were at camera, e.g. into a terrain chunk
+        saved = self.camera
+        self.camera = camera
+        try:
+            yield
+        finally:
+            self.camera = saved
+
     def _xy_offset(self, x, y):
-        # Tile position offsets
+        # Tile position offsets on the grid surface
         if y % 2 == 0:
             x_offset = SQRT3 * self.radius * x
         else:
             x_offset = SQRT3 * self.radius * (x + 0.5)
         y_offset = 1.5 * self.radius * y
-        return x_offset, y_offset
+        return x_offset - self.camera[0], y_offset - self.camera[1]
 
-    def draw_base(self, tile, color=None):
-        x_offset, y_offset = self._xy_offset(tile.x, tile.y)
-        # Hex corner locations
-        points = [
-            (0.5 * SQRT3 * self.radius, 0),
-            (SQRT3 * self.radius, 0.5 * self.radius),
-            (SQRT3 * self.radius, 1.5 * self.radius),
-            (0.5 * SQRT3 * self.radius, 2 * self.radius),
-            (0, 1.5 * self.radius),
-            (0, 0.5 * self.radius)
-        ]
-        points = [(x + x_offset, y + y_offset) for (x, y) in points]
+    def pixel_to_pos(self, px, py):
+        # Inverse of _xy_offset: the board position whose hex contains a
+        # pixel, or None off the board. Rows are offset every other row, so
+        # convert to axial coordinates from the centre of hex (0, 0) and
+        # round in cube coordinates.
+        px = (px + self.camera[0]) / self.radius - 0.5 * SQRT3
+        py = (py + self.camera[1]) / self.radius - 1
+        q = px / SQRT3 - py / 3
+        r = 2 * py / 3
+        s = -q - r
+        rq, rr, rs = round(q), round(r), round(s)
+        dq, dr, ds = abs(rq - q), abs(rr - r), abs(rs - s)
+        if dq > dr and dq > ds:
+            rq = -rr - rs
+        elif dr > ds:
+            rr = -rq - rs
+        x = int(rq + (rr - (rr & 1)) // 2)
+        y = int(rr)
+        if 0 <= x < self.board.shape[0] and 0 <= y < self.board.shape[1]:
+            return x, y
+        return None
+
+    def _hex_points(self, pos):
+        return self.vertices[pos] - self.camera
+
+    @staticmethod
+    def _world_rect(pos, radius):
+        # Bounding rect of a hex and its outline in world pixels
+        x, y = pos
+        return pg.Rect(
+            int(math.floor(SQRT3 * radius * (x + 0.5 * (y % 2)))) - HEX_MARGIN,
+            int(math.floor(1.5 * radius * y)) - HEX_MARGIN,
+            int(math.ceil(SQRT3 * radius)) + 2 * HEX_MARGIN + 1,
+            int(math.ceil(2 * radius)) + 2 * HEX_MARGIN + 1
+        )
+
+    def _hex_rect(self, pos):
+        rect = self._world_rect(pos, self.radius).move(-self.camera[0], -self.camera[1])
+        return rect.clip(self.get_rect())
+
+    def draw_base(self, tile, color=None, surface=None):
+        surface = (self if surface is None else surface)
+        points = self._hex_points(tile.pos)
         # Get color
         if color is None:
             color = self._get_base_color(tile.base)
         # Hex tile
-        poly = pg.draw.polygon(self, color, points)
+        poly = pg.draw.polygon(surface, color, points)
         # Black outline
-        pg.draw.polygon(self, pg.Color(0, 0, 0), points, 2)
+        pg.draw.polygon(surface, pg.Color(0, 0, 0), points, 2)
         return poly
 
-    def draw_features(self, tile, color=None):
+    def draw_features(self, tile, color=None, surface=None):
+        surface = (self if surface is None else surface)
         x_offset, y_offset = self._xy_offset(tile.x, tile.y)
         if color is None:
             color = self._get_feature_color(tile.features[-1])
         circle_pos = (
-            int(x_offset + 0.5 * SQRT3 * self.radius),
-            int(y_offset + self.radius)
+            math.floor(x_offset + 0.5 * SQRT3 * self.radius),
+            math.floor(y_offset + self.radius)
         )
         circle_r = int(round(0.5 * self.radius))
-        pg.draw.circle(self, color, circle_pos, circle_r)
+        pg.draw.circle(surface, color, circle_pos, circle_r)
         return
 
-    def draw_city(self, pos, color):
+    def draw_city(self, pos, color, surface=None):
+        surface = (self if surface is None else surface)
         x_offset, y_offset = self._xy_offset(*pos)
         triangle = [
             (x_offset + 0.5 * SQRT3 * self.radius - self.radius / SQRT3, y_offset + 1.5 * self.radius),
             (x_offset + 0.5 * SQRT3 * self.radius + self.radius / SQRT3, y_offset + 1.5 * self.radius),
             (x_offset + 0.5 * SQRT3 * self.radius, y_offset + 0.5 * self.radius)
         ]
-        pg.draw.polygon(self, color, triangle)
+        pg.draw.polygon(surface, color, np.floor(triangle))
         return
 
-    def draw_territory(self, pos, color):
-        x_offset, y_offset = self._xy_offset(*pos)
-        points = [
-            (0.5 * SQRT3 * self.radius, 0),
-            (SQRT3 * self.radius, 0.5 * self.radius),
-            (SQRT3 * self.radius, 1.5 * self.radius),
-            (0.5 * SQRT3 * self.radius, 2 * self.radius),
-            (0, 1.5 * self.radius),
-            (0, 0.5 * self.radius)
-        ]
-        points = [(x + x_offset, y + y_offset) for (x, y) in points]
-        if color is None:
-            color = self._get_base_color(tile.base)
-        pg.draw.polygon(self, color, points, 4)
+    def draw_territory(self, pos, color, surface=None):
+        surface = (self if surface is None else surface)
+        pg.draw.polygon(surface, color, self._hex_points(pos), 4)
         return
 
-    def draw_unit(self, pos, color, bordercolor=colorname2pg('black')):
+    def draw_unit(self, pos, color, bordercolor=colorname2pg('black'), surface=None):
+        surface = (self if surface is None else surface)
         x_offset, y_offset = self._xy_offset(*pos)
         circle_pos = (
-            int(x_offset + 0.5 * SQRT3 * self.radius),
-            int(y_offset + self.radius)
+            math.floor(x_offset + 0.5 * SQRT3 * self.radius),
+            math.floor(y_offset + self.radius)
         )
         circle_r = int(round(0.4 * self.radius))
-        pg.draw.circle(self, bordercolor, circle_pos, circle_r)
-        pg.draw.circle(self, color, circle_pos, int(0.6 * circle_r))
+        pg.draw.circle(surface, bordercolor, circle_pos, circle_r)
+        pg.draw.circle(surface, color, circle_pos, int(0.6 * circle_r))
         return
 
-    def draw_civ(self, civ):
+    def draw_civ(self, civ, surface=None):
         color = self._get_civ_color(civ.name)
         for city in civ:
-            self.draw_city(city.tiles[0].pos, color)
+            if self.in_view(city.tiles[0].pos):
+                self.draw_city(city.tiles[0].pos, color, surface=surface)
             for tile in city:
-                self.draw_territory(tile.pos, color)
+                if self.in_view(tile.pos):
+                    self.draw_territory(tile.pos, color, surface=surface)
         for unit in civ.units:
-            self.draw_unit(unit.pos, color)
+            if self.in_view(unit.pos):
+                self.draw_unit(unit.pos, color, surface=surface)
         return
 
-    def draw_text_grid_overlay(self, array, font):
-        for i in range(array.shape[0]):
-            for j in range(array.shape[1]):
-                text = font.render(str(array[i, j]), 1, (255, 255, 255))
-                text_rect = text.get_rect()
-                if j % 2 == 0:
-                    x = SQRT3 * self.radius * (i + 0.5)
-                else:
-                    x = SQRT3 * self.radius * (i + 1)
-                y = 1.5 * self.radius * (j + 1)
-                text_rect.center = (x, y - font.get_height())
-                self.blit(text, text_rect)
+    def draw_civs(self, surface=None):
+        for civ in self.civs:
+            self.draw_civ(civ, surface=surface)
+
+    def draw_highlight(self, highlight, surface=None):
+        # Darken every tile not in highlight
+        surface = (self if surface is None else surface)
+        positions = set(tile.pos for tile in highlight)
+        for pos in self.visible():
+            if pos not in positions:
+                pg.draw.polygon(surface, HIGHLIGHT_SHADE, self._hex_points(pos))
+
+    def draw_path(self, path, surface=None):
+        for p in path:
+            if self.in_view(p):
+                self.draw_territory(p, pg.Color(255, 0, 0), surface=surface)
+
+    def draw_text_grid_overlay(self, array, font, surface=None):
+        surface = (self if surface is None else surface)
+        for pos in self.visible():
+            text = self.text_cache.render(font, str(array[pos]))
+            text_rect = text.get_rect()
+            x_offset, y_offset = self._xy_offset(*pos)
+            text_rect.center = (x_offset + 0.5 * SQRT3 * self.radius, y_offset + 1.5 * self.radius - font.get_height())
+            surface.blit(text, text_rect)
         return
 
-    def draw(self, highlight=None):
-        polygons = []
-        for tile in self.board:
-            color = None
-            if highlight:
-                if tile not in highlight:
-                    color = pg.Color(0, 0, 0)
-            poly = self.draw_base(tile, color)
-            polygons.append((tile, poly))
-            if tile.features:
-                self.draw_features(tile, color)
+    def draw_tile(self, tile, surface=None):
+        self.draw_base(tile, surface=surface)
+        if tile.features:
+            self.draw_features(tile, surface=surface)
+
+    def chunk(self, i, j):
+        # Terrain of the CHUNK_SIZE square at (i, j) * CHUNK_SIZE in world
+        # pixels at the current zoom level. pygame shifts the pixels of
+        # outlines it clips, so the hexes are drawn on a surface padded by a
+        # whole hex and the middle is cut out, keeping chunk seams invisible.
+        key = (self.radius, i, j)
+        chunk = self.chunks.get(key)
+        if chunk is not None:
+            self.chunks.move_to_end(key)
+            return chunk
+        pad = int(math.ceil(2 * self.radius)) + 2 * HEX_MARGIN
+        padded = pg.Surface((CHUNK_SIZE + 2 * pad, CHUNK_SIZE + 2 * pad))
+        with self._viewing((i * CHUNK_SIZE - pad, j * CHUNK_SIZE - pad)):
+            for pos in self.cells_in(pg.Rect(pad, pad, CHUNK_SIZE, CHUNK_SIZE)):
+                self.draw_tile(self.board[pos], surface=padded)
+        chunk = padded.subsurface((pad, pad, CHUNK_SIZE, CHUNK_SIZE)).copy()
+        self.chunks[key] = chunk
+        if len(self.chunks) > MAX_CHUNKS:
+            self.chunks.popitem(last=False)
+        return chunk
+
+    def render_terrain(self):
+        self.terrain = pg.Surface((self.width, self.height))
+        x, y = self.camera
+        for i in range(x // CHUNK_SIZE, (x + self.width - 1) // CHUNK_SIZE + 1):
+            for j in range(y // CHUNK_SIZE, (y + self.height - 1) // CHUNK_SIZE + 1):
+                self.terrain.blit(self.chunk(i, j), (i * CHUNK_SIZE - x, j * CHUNK_SIZE - y))
+        self._full = True
+
+    def update_terrain(self, positions=None):
+        # Redraw only the tiles whose base or features changed since the last
+        # call, dropping the cached chunks they appear in. Returns their
+        # positions. Only the tiles at positions are checked if given, e.g.
+        # Game.changed_tiles, otherwise the whole board is.
+        changed = []
+        tiles = (self.board if positions is None else [self.board[pos] for pos in positions])
+        for tile in tiles:
+            key = (tile.base, tuple(tile.features))
+            if self._tile_keys[tile.pos] != key:
+                self.drop_chunks(tile.pos)
+                self._tile_keys[tile.pos] = key
+                changed.append(tile.pos)
+        if self.terrain is None:
+            self.render_terrain()
+        else:
+            for pos in changed:
+                if self.in_view(pos):
+                    self.draw_tile(self.board[pos], surface=self.terrain)
+                    self._dirty.add(pos)
+        return changed
+
+    def drop_chunks(self, pos):
+        # Forget the cached terrain chunks, at any zoom level, that a hex
+        # overlaps
+        for key in list(self.chunks):
+            radius, i, j = key
+            if self._world_rect(pos, radius).colliderect((i * CHUNK_SIZE, j * CHUNK_SIZE, CHUNK_SIZE, CHUNK_SIZE)):
+                del self.chunks[key]
+
+    def civ_cells(self):
+        # What draw_civs puts on each position in view, in drawing order
+        cells = {}
         for civ in self.civs:
-            self.draw_civ(civ)
-        return polygons
+            for city in civ:
+                cells.setdefault(city.tiles[0].pos, []).append(('city', civ.name))
+                for tile in city:
+                    cells.setdefault(tile.pos, []).append(('territory', civ.name))
+            for unit in civ.units:
+                cells.setdefault(unit.pos, []).append(('unit', civ.name))
+        return {pos: cell for pos, cell in cells.items() if self.in_view(pos)}
 
-    @staticmethod
-    def _get_base_color(base):
-        b_color = BASE_COLORS.get(base)
-        return colorname2pg(b_color)
+    def mark(self, old, new):
+        # Mark dirty the positions where two cell maps (see layer) differ
+        if old is None or new is None:
+            self._full = True
+            return
+        for pos in set(old) | set(new):
+            if old.get(pos) != new.get(pos):
+                self._dirty.add(pos)
 
-    @staticmethod
-    def _get_feature_color(feature):
-        f_color = FEATURE_COLORS.get(feature)
-        return colorname2pg(f_color)
+    def layer(self, name, key, render, cells):
+        # Transparent overlay, redrawn by render(surface) only when key differs
+        # from the one it was last drawn for. cells() maps each position the
+        # overlay draws on to what it draws there, or is None if the overlay
+        # isn't confined to hexes, and is diffed against the last overlay
+        # shown to find the dirty hexes.
+        cached = self.layers.get(name)
+        old = (cached[2] if cached is not None and name in self._shown else {})
+        if cached is None or cached[0] != key:
+            surface = pg.Surface((self.width, self.height), pg.SRCALPHA)
+            render(surface)
+            cached = (key, surface, cells())
+            self.layers[name] = cached
+            self.mark(old, cached[2])
+        elif name not in self._shown:
+            self.mark(old, cached[2])
+        return name
 
-    @staticmethod
-    def _get_civ_color(civ):
-        c_color = CIV_COLORS.get(civ)
-        return colorname2pg(c_color)
+    def draw(self, highlight=None, path=None, text=None, state=None):
+        # state identifies the civs' cities and units as last drawn (e.g.
+        # game.zobrist), None to redraw them; text is an (array, font) pair
+        # for draw_text_grid_overlay. Returns the rects that changed.
+        if self.terrain is None:
+            self.render_terrain()
+        shown = []
+        if highlight:
+            key = frozenset(tile.pos for tile in highlight)
+            shown.append(self.layer('highlight', key, lambda s: self.draw_highlight(highlight, s),
+                lambda: {pos: True for pos in self.visible() if pos not in key}))
+        key = (state if state is not None else object())
+        shown.append(self.layer('civs', key, self.draw_civs, self.civ_cells))
+        if path:
+            shown.append(self.layer('path', tuple(path), lambda s: self.draw_path(path, s),
+                lambda: {pos: True for pos in path if self.in_view(pos)}))
+        if text is not None:
+            array, font = text
+            # Game.settler_scores and worker_scores return TileArrays. The
+            # same array is passed frame after frame, so its values are only
+            # read into a key when a different one comes in.
+            if self._text_key is None or self._text_key[0] is not array:
+                self._text_key = (array, tuple(np.asarray(array).ravel()))
+            key = (self._text_key[1], font)
+            shown.append(self.layer('text', key, lambda s: self.draw_text_grid_overlay(array, font, s), lambda: None))
+        for name in self._shown:
+            if name not in shown:
+                self.mark(self.layers[name][2], {})
+        self._shown = shown
+        if self._full:
+            rects = [self.get_rect()]
+        else:
+            rects = [self._hex_rect(pos) for pos in self._dirty]
+            if len(rects) > MAX_DIRTY_RECTS:
+                rects = [rects[0].unionall(rects[1:])]
+        for rect in rects:
+            self.blit(self.terrain, rect, rect)
+            for name in shown:
+                self.blit(self.layers[name][1], rect, rect)
+        self._dirty = set()
+        self._full = False
+        return rects
+
+    def _get_base_color(self, base):
+        return self.base_colors[base]
+
+    def _get_feature_color(self, feature):
+        return self.feature_colors[feature]
+
+    def _get_civ_color(self, civ):
+        return self.civ_colors[civ]
+
+
+class Minimap:
+    # Whole-board overview at one pixel per tile, scaled to a panel: terrain
+    # colours, mixed with the owning civ's colour on city tiles, and city
+    # centres in full civ colour. Pixels are looked up from per-tile base,
+    # feature and owner codes through colour tables and written with
+    # pygame.surfarray, and only the tiles that changed are looked up again.
+    def __init__(self, grid, width=MINIMAP_WIDTH):
+        self.grid = grid
+        self.board = grid.board
+        shape = self.board.shape
+        bases = list(grid.base_colors)
+        features = list(grid.feature_colors)
+        civs = list(grid.civ_colors)
+        self._base_codes = {base: i for i, base in enumerate(bases)}
+        self._feature_codes = {feature: i + 1 for i, feature in enumerate(features)}
+        self._civ_codes = {civ: i + 1 for i, civ in enumerate(civs)}
+        base_rgb = np.array([tuple(grid.base_colors[b])[:3] for b in bases], dtype=int)
+        feature_rgb = np.array([tuple(grid.feature_colors[f])[:3] for f in features], dtype=int).reshape(-1, 3)
+        # [base, feature]: the base colour alone for feature code 0, else
+        # mixed with the (last) feature's
+        self.terrain_lut = np.empty((len(bases), len(features) + 1, 3), dtype=int)
+        self.terrain_lut[:, 0] = base_rgb
+        self.terrain_lut[:, 1:] = (base_rgb[:, None] + feature_rgb[None]) // 2
+        self.civ_lut = np.zeros((len(civs) + 1, 3), dtype=int)
+        self.civ_lut[1:] = [tuple(grid.civ_colors[c])[:3] for c in civs]
+        self.bases = np.zeros(shape, dtype=int)
+        self.features = np.zeros(shape, dtype=int)
+        self.owners = np.zeros(shape, dtype=int)
+        self.centers = np.zeros(shape, dtype=bool)
+        for tile in self.board:
+            self._set_terrain(tile)
+        self._owned = {}
+        self._update_owners()
+        self.rgb = np.zeros(shape + (3,), dtype=np.uint8)
+        self.rgb[...] = self._lookup(tuple(np.indices(shape)))
+        self.surface = pg.Surface(shape)
+        aspect = (1.5 * shape[1] + 0.5) / (SQRT3 * (shape[0] + 0.5))
+        self.size = (width, max(int(round(width * aspect)), 1))
+        self.version = 0
+        self.panel = None
+        self._refresh()
+
+    def _set_terrain(self, tile):
+        self.bases[tile.pos] = self._base_codes[tile.base]
+        self.features[tile.pos] = (self._feature_codes[tile.features[-1]] if tile.features else 0)
+
+    def _update_owners(self):
+        # Owner codes from the civs' cities. Returns the positions whose code
+        # changed.
+        owned = {}
+        for civ in self.grid.civs:
+            code = self._civ_codes[civ.name]
+            for city in civ:
+                for tile in city:
+                    owned[tile.pos] = (code, False)
+                owned[city.tiles[0].pos] = (code, True)
+        changed = [pos for pos in set(owned) | set(self._owned) if owned.get(pos) != self._owned.get(pos)]
+        for pos in changed:
+            self.owners[pos], self.centers[pos] = owned.get(pos, (0, False))
+        self._owned = owned
+        return changed
+
+    def _lookup(self, index):
+        # Colours of the tiles at index, e.g. (xs, ys) arrays
+        rgb = self.terrain_lut[self.bases[index], self.features[index]]
+        owners = self.owners[index]
+        civ_rgb = self.civ_lut[owners]
+        owned = (owners > 0)[..., None]
+        rgb = np.where(owned, (rgb + civ_rgb) // 2, rgb)
+        return np.where(self.centers[index][..., None], civ_rgb, rgb)
+
+    def _refresh(self):
+        pg.surfarray.blit_array(self.surface, self.rgb)
+        self.panel = pg.transform.scale(self.surface, self.size)
+        self.version += 1
+
+    def update(self, changed=()):
+        # Look up again the tiles in changed (see RenderGrid.update_terrain)
+        # and those whose owner changed
+        for pos in changed:
+            self._set_terrain(self.board[pos])
+        positions = set(changed) | set(self._update_owners())
+        if not positions:
+            return
+        xs, ys = np.array(list(positions)).T
+        self.rgb[xs, ys] = self._lookup((xs, ys))
+        self._refresh()
+
+    def viewport(self):
+        # The grid's viewport on the panel
+        world_w, world_h = self.grid.world_size()
+        sx = self.size[0] / world_w
+        sy = self.size[1] / world_h
+        x, y = self.grid.camera
+        return pg.Rect(int(x * sx), int(y * sy), int(math.ceil(self.grid.width * sx)), int(math.ceil(self.grid.height * sy)))
+
+    def to_world(self, pos):
+        # World pixel at a point on the panel
+        world_w, world_h = self.grid.world_size()
+        return pos[0] * world_w / self.size[0], pos[1] * world_h / self.size[1]
+
+    def draw(self, surface, pos):
+        rect = surface.blit(self.panel, pos)
+        view = self.viewport().move(*pos).clip(rect)
+        if view != rect:
+            pg.draw.rect(surface, pg.Color(255, 255, 255), view, 1)
+        return rect
 
 
 class UserState:
@@ -205,13 +664,26 @@ class RenderGame:
         self.font = pg.font.SysFont("Trebuchet", self.fontsize)
         self.clock = pg.time.Clock()
 
-        self.grid = RenderGrid(self.game.board, self.game.civs, screen_size=self.screen_size)
-        self.grid2 = RenderGrid(self.game.board, self.game.civs, screen_size=self.screen_size)
-        self.grid2.set_alpha(80)
+        self.text_cache = TextCache()
+        self.grid = RenderGrid(self.game.board, self.game.civs, screen_size=self.screen_size, text_cache=self.text_cache)
+        start = self.game.active_civ()
+        if start.cities or start.units:
+            self.grid.center_on((start.cities or start.units)[0].pos)
+        self.minimap = Minimap(self.grid)
+        self.minimap_pos = (self.screen_size[0] - self.minimap.size[0], self.screen_size[1] - self.minimap.size[1])
+        self._drawn_state = None
+        # Game.tile_version the terrain was last brought up to date for
+        self._tile_version = self.game.tile_version
+        # (selection key, highlight, text, paths) last computed by
+        # selection_preview
+        self._preview = None
+        # Text boxes drawn over the grid last frame, and where
+        self._overlays = None
+        self._overlay_rects = []
 
         # Initialize user interaction state
         self._init_user_state(
-            hover_tile = None,
+            hover_pos = None,
             hover_tile_time = time.time(),
             active_tile = None,
             active_unit = None,
@@ -235,6 +707,29 @@ class RenderGame:
             else:
                 return img_output
 
+    def watch(self, simulation):
+        # Draw the latest snapshots of a Simulation at the frame rate until it
+        # hands the game over to a human. Only the camera and tile info respond
+        # to the mouse meanwhile.
+        if self.__enable_render:
+            try:
+                while not simulation.waiting():
+                    snapshot = simulation.snapshot()
+                    if snapshot is not self.game:
+                        self.set_game(snapshot)
+                    self.frame(interactive=False)
+            except Exception as e:
+                self.quit_game()
+                raise e
+
+    def set_game(self, game):
+        # Draw another copy of the game from now on, e.g. a Simulation
+        # snapshot
+        self.game = game
+        self.grid.board = game.board
+        self.grid.civs = game.civs
+        self.minimap.board = game.board
+
     def __on_click(self, tile):
         unit = self.game.get_unit(tile)
         units = self.game.get_units(tile)
@@ -291,99 +786,158 @@ class RenderGame:
 
     def __view_update(self):
         while True:
-            polygons = self.grid.draw()
-            mouse = pg.mouse.get_pos()
-            tile, polygon = self.get_tile(polygons, mouse)
-            unit = self.game.get_unit(tile)
-            city = self.game.get_city(tile)
-            civ = self.game.get_civ(tile)
-            if unit and not civ:
-                civ = self.game.find_civ(unit.civ)
-            unit_selected = (unit and unit.pos == tile.pos and unit.civ == self.game.active_civ().name)
-            city_selected = (city and city.tiles[0] == tile and city.civ == self.game.active_civ().name)
-            for ev in pg.event.get():
-                if ev.type == pg.QUIT:
-                    pg.quit()
-                    sys.exit()
-                #==========================================================
-                # HUMAN USER INPUTS
-
-                if ev.type == pg.MOUSEBUTTONUP:
-                    user_action = self.__on_click(tile)
+            user_action = self.frame()
+            if user_action:
+                return user_action
+
+    def frame(self, interactive=True):
+        # Handle input and draw one frame. Returns the human's action if they
+        # made one. Without interactive, clicks and key commands other than
+        # quitting are ignored, e.g. while bots play.
+        if self._drawn_state != self.game.zobrist:
+            changed = self.game.changed_tiles(self._tile_version)
+            self._tile_version = self.game.tile_version
+            self.minimap.update(self.grid.update_terrain(changed))
+            self._drawn_state = self.game.zobrist
+        # Arrow keys pan the camera while held
+        keys = pg.key.get_pressed()
+        self.grid.pan(PAN_SPEED * (keys[pg.K_RIGHT] - keys[pg.K_LEFT]), PAN_SPEED * (keys[pg.K_DOWN] - keys[pg.K_UP]))
+        mouse = pg.mouse.get_pos()
+        tile = self.get_tile(mouse)
+        # Compared by position, as snapshots have their own tiles
+        hover_moved = (self.user_state.hover_pos != (tile.pos if tile else None))
+        unit = self.game.get_unit(tile)
+        city = self.game.get_city(tile)
+        civ = self.game.get_civ(tile)
+        if unit and not civ:
+            civ = self.game.find_civ(unit.civ)
+        unit_selected = (unit and unit.pos == tile.pos and unit.civ == self.game.active_civ().name)
+        city_selected = (city and city.tiles[0] == tile and city.civ == self.game.active_civ().name)
+        for ev in pg.event.get():
+            if ev.type == pg.QUIT:
+                pg.quit()
+                sys.exit()
+            #==========================================================
+            # HUMAN USER INPUTS
+
+            if ev.type == pg.MOUSEWHEEL:
+                self.grid.zoom(ev.y, mouse)
+            elif ev.type == pg.MOUSEBUTTONUP and ev.button not in (4, 5) and self.minimap_rect().collidepoint(mouse):
+                # Clicking the minimap centres the camera there
+                x, y = self.minimap.to_world((mouse[0] - self.minimap_pos[0], mouse[1] - self.minimap_pos[1]))
+                self.grid.set_camera(x - 0.5 * self.grid.width, y - 0.5 * self.grid.height)
+            elif ev.type == pg.MOUSEBUTTONUP and ev.button not in (4, 5) and interactive:
+                # Buttons 4 and 5 repeat wheel scrolls. Popup menus draw
+                # over the whole display.
+                self._overlays = None
+                user_action = self.__on_click(tile)
+                if user_action:
+                    self.user_state.reset()
+                    return user_action
+            elif ev.type == pg.USEREVENT and interactive:
+                if ev.code == 'MENU':
+                    user_action = self.__on_menu_action(ev)
                     if user_action:
                         self.user_state.reset()
                         return user_action
-                elif ev.type == pg.USEREVENT:
-                    if ev.code == 'MENU':
-                        user_action = self.__on_menu_action(ev)
-                        if user_action:
-                            self.user_state.reset()
-                            return user_action
-                elif ev.type == pg.KEYDOWN:
-                    if ev.key == pg.K_c and pg.key.get_mods() & pg.KMOD_CTRL:
-                        raise KeyboardInterrupt
-                    elif ev.key == pg.K_RETURN and pg.key.get_mods() & pg.KMOD_SHIFT:
-                        return Action('end_turn') #self.game.end_turn()
-
-                #==========================================================
-            # Highlight tiles
-            if self.user_state.active_unit and self.user_state.menu_selection:
+            elif ev.type == pg.KEYDOWN:
+                if ev.key == pg.K_c and pg.key.get_mods() & pg.KMOD_CTRL:
+                    raise KeyboardInterrupt
+                elif ev.key == pg.K_RETURN and pg.key.get_mods() & pg.KMOD_SHIFT and interactive:
+                    return Action('end_turn') #self.game.end_turn()
+
+            #==========================================================
+        # Highlight tiles
+        highlight = None
+        path = None
+        text = None
+        if self.user_state.active_unit and self.user_state.menu_selection:
+            highlight, text, paths = self.selection_preview()
+            if self.user_state.menu_selection == 'move':
+                if hover_moved and tile is not None:
+                    came_from, costs = paths
+                    path = civutils.trace_path(came_from, tile.pos)
+                    self.user_state.update(path=path, distance=costs[tile.pos])
+                path = self.user_state.path
+        dirty = self.grid.draw(highlight, path=path, text=text, state=self.game.zobrist)
+        overlays = [('textbox', self.turn_box()), ('minimap', (self.minimap.version, self.grid.camera, self.grid.radius))]
+        if tile:
+            if self.user_state.active_unit:
                 if self.user_state.menu_selection == 'move':
-                    if self.user_state.hover_tile != tile and tile is not None:
-                        path, costs = civutils.find_best_path(self.user_state.active_unit.pos, tile.pos, self.game)
-                        distance = costs[tile.pos]
-                        self.user_state.update(path=path, distance=distance)
                     if self.user_state.path:
-                        for p in self.user_state.path:
-                            self.grid.draw_territory(p, pg.Color(255, 0, 0))
-                    highlight = self.user_state.active_unit.get_moves(self.game)
-                    if self.user_state.active_unit._class == 'settler':
-                        data = self.game.settler_scores(self.user_state.active_unit)
-                        self.grid.draw_text_grid_overlay(data, self.font)
-                    if self.user_state.active_unit._class == 'worker':
-                        data = self.game.worker_scores(self.user_state.active_unit)
-                        self.grid.draw_text_grid_overlay(data, self.font)
-                elif 'attack' in self.user_state.menu_selection:
-                    highlight = self.user_state.active_unit.get_targets(self.game)
-                else:
-                    highlight = None
-            else:
-                highlight = None
-            self.grid2.draw(highlight)
-            self.__blit(self.grid, (0, 0))
-            self.__blit(self.grid2, (0, 0))
-            self.show_turn()
-            if tile:
-                if self.user_state.active_unit:
-                    if self.user_state.menu_selection == 'move':
-                        if self.user_state.path:
-                            self.show_distance(self.user_state.distance, mouse)
-                if self.user_state.hover_tile != tile:
-                    self.user_state.update(hover_tile=tile, tile_hover_time=time.time())
-                if time.time() - self.user_state.tile_hover_time > TILE_INFO_DELAY:
-                    self.show_tile_info(tile, mouse)
-            pg.display.update()
+                        overlays.append(('distance', (self.user_state.distance, mouse)))
+            if hover_moved:
+                self.user_state.update(hover_pos=tile.pos, tile_hover_time=time.time())
+            if time.time() - self.user_state.tile_hover_time > TILE_INFO_DELAY:
+                overlays.append(('textbox', (mouse, self.tile_info_text(tile))))
+        if self._overlays is None:
+            dirty = [self.surface.get_rect()]
+        elif not dirty and overlays == self._overlays:
             self.clock.tick(self.rate)
+            return None
+        # Restore the grid under the changed hexes and the old text boxes,
+        # then draw the text boxes again on top
+        dirty += self._overlay_rects
+        for rect in dirty:
+            self.__blit(self.grid, rect, rect)
+        self._overlay_rects = [getattr(self, 'show_' + name)(*args) for name, args in overlays]
+        self._overlays = overlays
+        pg.display.update(dirty + self._overlay_rects)
+        self.clock.tick(self.rate)
+        return None
+
+    def selection_preview(self):
+        # Highlight, score overlay and (for moves) search tree from the
+        # selected unit for its menu action, recomputed only when the
+        # selection or the game state changes. Hovered paths are traced back
+        # through the tree.
+        unit = self.user_state.active_unit
+        selection = self.user_state.menu_selection
+        key = (unit.name, selection, self.game.zobrist)
+        if self._preview is None or self._preview[0] != key:
+            highlight = None
+            text = None
+            paths = None
+            if selection == 'move':
+                highlight = unit.get_moves(self.game)
+                paths = civutils.find_paths(unit.pos, self.game)
+                if unit._class == 'settler':
+                    text = (self.game.settler_scores(unit), self.font)
+                if unit._class == 'worker':
+                    text = (self.game.worker_scores(unit), self.font)
+            elif 'attack' in selection:
+                highlight = unit.get_targets(self.game)
+            self._preview = (key, highlight, text, paths)
+        return self._preview[1:]
 
     def __blit(self, *args):
         self.surface.blit(*args)
 
-    def get_tile(self, polygons, mouse):
-        for t, p in polygons:
-            if p.inflate(-3, -3).collidepoint(mouse):
-                return t, p
-        return None, None
+    def minimap_rect(self):
+        return pg.Rect(self.minimap_pos, self.minimap.size)
+
+    def show_minimap(self, *state):
+        # state only tells frames with different minimaps apart
+        return self.minimap.draw(self.surface, self.minimap_pos)
+
+    def get_tile(self, mouse):
+        if self.minimap_rect().collidepoint(mouse):
+            return None
+        pos = self.grid.pixel_to_pos(*mouse)
+        if pos is None:
+            return None
+        return self.game.board[pos]
 
     def show_distance(self, distance, mouse):
-        text = self.font.render(str(distance), 1, (255, 255, 255))
+        text = self.text_cache.render(self.font, str(distance))
         text_rect = text.get_rect()
         text_rect.bottomleft = (mouse[0], mouse[1] - self.font.get_height())
         self.__blit(text, text_rect)
-        return
+        return text_rect
 
     def show_settler_score(self, pos, mouse):
         score = self.game.settler_score(pos)
-        text = self.font.render(str(score), 1, (255, 255, 255))
+        text = self.text_cache.render(self.font, str(score))
         text_rect = text.get_rect()
         text_rect.bottomleft = (mouse[0], mouse[1] - self.font.get_height())
         self.__blit(text, text_rect)
@@ -391,7 +945,7 @@ class RenderGame:
 
     def show_worker_score(self, pos, mouse):
         score = self.game.worker_score(pos)
-        text = self.font.render(str(score), 1, (255, 255, 255))
+        text = self.text_cache.render(self.font, str(score))
         text_rect = text.get_rect()
         text_rect.bottomleft = (mouse[0], mouse[1] - self.font.get_height())
         self.__blit(text, text_rect)
@@ -430,14 +984,15 @@ class RenderGame:
 
     def show_tile_info(self, tile, mouse):
         text = self.tile_info_text(tile)
-        self.show_textbox(mouse, text)
-        return
+        return self.show_textbox(mouse, text)
 
-    def show_turn(self):
+    def turn_box(self):
         text = "Turn: {}\nActive civ: {}".format(self.game.turn, self.game.active_civ().name)
         pos = (self.screen_size[0] - max(self.font.size(line)[0] for line in text.splitlines()), 0)
-        self.show_textbox(pos, text)
-        return
+        return pos, text
+
+    def show_turn(self):
+        return self.show_textbox(*self.turn_box())
 
     def show_textbox(self, pos, text, color=None):
         lines = text.splitlines()
@@ -454,13 +1009,12 @@ class RenderGame:
             x, y, box[0], box[1])
         tile_text_bg = self.__draw_rect(pg.Color(0, 0, 0), tile_text_bg_rect)
         for i, line in enumerate(lines):
-            tile_text = self.font.render(
-                line, 1, (255, 255, 255))
+            tile_text = self.text_cache.render(self.font, line)
             tile_text_rect = tile_text.get_rect()
             text_pos = (x, y + self.font.get_height() * i)
             tile_text_rect.topleft = text_pos
             self.__blit(tile_text, tile_text_rect)
-        return
+        return tile_text_bg_rect
 
     def __draw_rect(self, color, rect):
         return pg.draw.rect(self.surface, color, rect)
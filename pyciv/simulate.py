@@ -0,0 +1,136 @@
+import threading
+import time
+
+from .utils import Action
+
+MAX_TURNS = 500
+MAX_ACTIONS_PER_TURN = 1000
+# Snapshots are published no more often than this many times the time the
+# last one took to copy, so copying costs bots at most a fifth of their time
+SNAPSHOT_COST_RATIO = 4
+
+
+def run(game, max_turns=MAX_TURNS, max_actions=MAX_ACTIONS_PER_TURN, on_turn=None):
+    # Bots-only game loop that never touches the render layer. Stops after
+    # max_turns full rounds or as soon as a single civ is left standing. Bots
+    # that keep acting past max_actions in one civ turn are forced to end it.
+    start = time.time()
+    start_turn = game.turn
+    n_actions = 0
+    n_forced = 0
+    turn_actions = 0
+    turn_start = start
+    while game.turn - start_turn < max_turns and game.winner() is None:
+        if turn_actions >= max_actions:
+            action = Action('end_turn')
+            n_forced += 1
+        else:
+            action = game.get_bot_action()
+        turn = game.turn
+        active = game.active
+        game.step(action)
+        n_actions += 1
+        turn_actions += 1
+        if game.active != active:
+            turn_actions = 0
+        if game.turn != turn and on_turn is not None:
+            now = time.time()
+            on_turn(game, now - turn_start)
+            turn_start = now
+    winner = game.winner()
+    return {
+        'winner': (winner.name if winner else None),
+        'turns': game.turn - start_turn,
+        'actions': n_actions,
+        'forced_end_turns': n_forced,
+        'time': time.time() - start
+    }
+
+
+class Simulation(threading.Thread):
+    # Plays the bots' turns of a game on a background thread so a render loop
+    # can keep drawing while they think. The render loop never touches the
+    # game while bots play: the thread publishes snapshots (Game.clone) for
+    # it to draw instead, at most every interval seconds. When a human civ is
+    # to move the thread hands the game over and waits, the render loop
+    # steps the human's actions itself and calls resume() once a bot is to
+    # move again. As in run, bots that keep acting past max_actions in one
+    # civ turn are forced to end it.
+    def __init__(self, game, interval=0.1, max_actions=MAX_ACTIONS_PER_TURN):
+        super(Simulation, self).__init__(daemon=True)
+        self.game = game
+        self.interval = interval
+        self.max_actions = max_actions
+        self.error = None
+        self._snapshot = None
+        self._snapshot_state = None
+        self._published = 0.
+        self._copy_time = 0.
+        self._lock = threading.Lock()
+        self._running = threading.Event()
+        self._waiting = threading.Event()
+        self._stopped = False
+        self._running.set()
+        self.publish()
+
+    def snapshot(self):
+        # Latest published copy of the game
+        with self._lock:
+            return self._snapshot
+
+    def waiting(self):
+        # Whether the game is handed over to a human, or the thread died
+        # (see error)
+        return self._waiting.is_set()
+
+    def resume(self):
+        # Hand the game back after human turns, starting from a snapshot of
+        # what they did
+        self.publish()
+        self._waiting.clear()
+        self._running.set()
+
+    def stop(self):
+        self._stopped = True
+        self._running.set()
+        if self.is_alive():
+            self.join()
+
+    def publish(self):
+        start = time.perf_counter()
+        snapshot = self.game.clone()
+        self._copy_time = time.perf_counter() - start
+        self._published = time.perf_counter()
+        self._snapshot_state = self.game.zobrist
+        with self._lock:
+            self._snapshot = snapshot
+
+    def run(self):
+        game = self.game
+        turn_actions = 0
+        active = None
+        try:
+            while True:
+                self._running.wait()
+                if self._stopped:
+                    return
+                if game.active != active:
+                    active = game.active
+                    turn_actions = 0
+                if game.active_civ().name in game.humans:
+                    self._running.clear()
+                    self._waiting.set()
+                    continue
+                if turn_actions >= self.max_actions:
+                    action = Action('end_turn')
+                else:
+                    action = game.get_bot_action()
+                if action:
+                    game.step(action)
+                    turn_actions += 1
+                wait = max(self.interval, SNAPSHOT_COST_RATIO * self._copy_time)
+                if game.zobrist != self._snapshot_state and time.perf_counter() - self._published >= wait:
+                    self.publish()
+        except BaseException as e:
+            self.error = e
+            self._waiting.set()
@@ -6,7 +6,7 @@ from .features import FEATURE_YIELDS, FEATURE_MOVES
 from .resources import RESOURCE_YIELDS
 from .improvements import IMPROVEMENT_YIELDS
 from .buildings import Building
-from .utils import neighbor
+from .utils import neighbor, copy_state
 
 
 class Tile(object):
@@ -56,6 +56,9 @@ class Tile(object):
     def add_improvement(self, improvement):
         self.improvements.append(improvement)
 
+    def copy(self):
+        return copy_state(self)
+
     @property
     def n_features(self):
         return len(self.features)
@@ -116,6 +119,14 @@ class TileArray(np.ndarray):
         new = super().__new__(cls, shape=shape, dtype=object)
         return new
 
+    def copy_tiles(self):
+        # Board of tile copies, for Game.clone. ndarray.copy is left alone,
+        # as numpy and score arrays made with zeros_like rely on it
+        out = TileArray(self.shape)
+        for tile in self:
+            out.set_tile(tile.copy())
+        return out
+
     def set_tile(self, tile):
         self[tile.x, tile.y] = tile
 
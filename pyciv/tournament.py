@@ -0,0 +1,143 @@
+import contextlib
+import csv
+import json
+import multiprocessing as mp
+import os
+import random
+import time
+import numpy as np
+
+from .game import Game
+from . import simulate
+
+CIVS = ['France', 'America']
+LEADERS = ['Me', 'You']
+RESULT_FIELDS = [
+    'game', 'seed', 'width', 'height', 'map_config', 'error', 'winner', 'turns',
+    'actions', 'time', 'turn_time_mean', 'turn_time_max'
+]
+CIV_FIELDS = ['cities', 'units', 'population']
+
+
+def make_specs(n_games, shapes, map_configs, seed=0, max_turns=simulate.MAX_TURNS, bot_options=None):
+    specs = []
+    for i in range(n_games):
+        specs.append({
+            'game': i,
+            'seed': seed + i,
+            'shape': tuple(shapes[i % len(shapes)]),
+            'map_config': map_configs[(i // len(shapes)) % len(map_configs)],
+            'max_turns': max_turns,
+            'bot_options': bot_options
+        })
+    return specs
+
+
+def play(spec):
+    row = {
+        'game': spec['game'],
+        'seed': spec['seed'],
+        'width': spec['shape'][0],
+        'height': spec['shape'][1],
+        'map_config': spec['map_config']
+    }
+    turn_times = []
+    random.seed(spec['seed'])
+    start = time.time()
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            game = Game(spec['shape'], civs=CIVS, leaders=LEADERS, map_config_file=spec['map_config'], bots_only=True, bot_options=spec.get('bot_options'))
+            result = simulate.run(game, max_turns=spec['max_turns'], on_turn=lambda g, dt: turn_times.append(dt))
+    except Exception as e:
+        row.update(error=repr(e), time=time.time() - start)
+        return row
+    row.update(
+        error=None,
+        winner=result['winner'],
+        turns=result['turns'],
+        actions=result['actions'],
+        time=result['time'],
+        turn_time_mean=(float(np.mean(turn_times)) if turn_times else None),
+        turn_time_max=(max(turn_times) if turn_times else None)
+    )
+    for civ in game.civs:
+        stats = {
+            'cities': len(civ.cities),
+            'units': len(civ.units),
+            'population': civ.totals['population']
+        }
+        for f in CIV_FIELDS:
+            row[f + '_' + civ.name] = stats[f]
+    return row
+
+
+class ResultWriter:
+    def __init__(self, path):
+        self.path = path
+        self.fmt = ('csv' if path.endswith('.csv') else 'jsonl')
+        self.file = open(path, 'w', newline='')
+        self.writer = None
+
+    def write(self, row):
+        if self.fmt == 'csv':
+            if self.writer is None:
+                fields = RESULT_FIELDS + [f + '_' + civ for civ in CIVS for f in CIV_FIELDS]
+                self.writer = csv.DictWriter(self.file, fieldnames=fields, extrasaction='ignore')
+                self.writer.writeheader()
+            self.writer.writerow(row)
+        else:
+            self.file.write(json.dumps(row) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def run(specs, processes=None, output=None, callback=None):
+    writer = (ResultWriter(output) if output else None)
+    results = []
+    try:
+        with mp.Pool(processes=processes) as pool:
+            for row in pool.imap_unordered(play, specs):
+                results.append(row)
+                if writer:
+                    writer.write(row)
+                if callback:
+                    callback(row)
+    finally:
+        if writer:
+            writer.close()
+    return sorted(results, key=lambda r: r['game'])
+
+
+def aggregate(results):
+    done = [r for r in results if r['error'] is None]
+    out = {
+        'games': len(results),
+        'errors': len(results) - len(done),
+        'wins': {},
+        'draws': len([r for r in done if r['winner'] is None])
+    }
+    for r in done:
+        if r['winner'] is not None:
+            out['wins'][r['winner']] = out['wins'].get(r['winner'], 0) + 1
+    if done:
+        out['turns_mean'] = float(np.mean([r['turns'] for r in done]))
+        out['time_mean'] = float(np.mean([r['time'] for r in done]))
+        turn_times = [r['turn_time_mean'] for r in done if r['turn_time_mean'] is not None]
+        out['turn_time_mean'] = (float(np.mean(turn_times)) if turn_times else None)
+        for civ in CIVS:
+            out['cities_mean_' + civ] = float(np.mean([r.get('cities_' + civ, 0) for r in done]))
+            out['population_mean_' + civ] = float(np.mean([r.get('population_' + civ, 0) for r in done]))
+    by_shape = {}
+    for r in done:
+        key = '{}x{}'.format(r['width'], r['height'])
+        by_shape.setdefault(key, []).append(r)
+    out['by_shape'] = {}
+    for key, rows in by_shape.items():
+        out['by_shape'][key] = {
+            'games': len(rows),
+            'turns_mean': float(np.mean([r['turns'] for r in rows])),
+            'turn_time_mean': float(np.mean([r['turn_time_mean'] or 0 for r in rows]))
+        }
+    return out
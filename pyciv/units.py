@@ -52,6 +52,17 @@ def create_unit(name, unit_class, **kwargs):
     return cls_(name, **kwargs)
 
 
+class Order:
+    # Standing move order: where the unit is going and the remaining steps of
+    # its cached path, not including the tile it is on
+    def __init__(self, goal, path):
+        self.goal = goal
+        self.path = path
+
+    def copy(self):
+        return Order(self.goal, self.path[:])
+
+
 class Unit:
     def __init__(self, name, _class=None, pos=None, civ=None, movement=2, cost=None, **kwargs):
         self.name = name
@@ -62,9 +73,16 @@ class Unit:
         self.movement = movement
         self.moves = movement
         self.cost = cost
+        self.order = None
         for k, v in kwargs.items():
             setattr(self, k, v)
 
+    def copy(self):
+        out = civutils.copy_state(self)
+        if self.order is not None:
+            out.order = self.order.copy()
+        return out
+
     def move(self, new_pos, moves):
         self.pos = new_pos
         self.moves -= moves
@@ -73,26 +91,31 @@ class Unit:
     def reset_moves(self):
         self.moves = self.movement
 
-    def get_moves(self, game):
+    def get_moves(self, game, costs=None):
         out = []
-        neighbors = civutils.neighbors(self.pos, game.board, r=self.moves)
-        for tile in neighbors:
-            path, costs = civutils.find_best_path(self.pos, tile.pos, game)
-            cost = costs[tile.pos]
-            if cost <= self.moves:
-                if self.moves >= tile.moves:
-                    target_unit = game.get_unit(tile)
-                    target_city = game.get_city(tile)
-                    if not target_unit and not target_city:
+        with game.stats.timer('moves'):
+            neighbors = civutils.neighbors(self.pos, game.board, r=self.moves)
+            if costs is None:
+                came_from, costs = civutils.find_paths(self.pos, game, max_cost=self.moves)
+            for tile in neighbors:
+                cost = costs.get(tile.pos)
+                if cost is not None and cost <= self.moves:
+                    if self.moves >= tile.moves and self.can_enter(tile, game):
                         out.append(tile)
-                    elif target_unit:
-                        if target_unit.civ == self.civ and target_unit._type != self._type:
-                            out.append(tile)
-                    elif target_city:
-                        if target_city.civ == self.civ:
-                            out.append(tile)
         return out
 
+    def can_enter(self, tile, game):
+        # Units may share a tile only with a friendly unit of another type, and
+        # may not enter foreign cities by moving
+        target_unit = game.get_unit(tile)
+        target_city = game.get_city(tile)
+        if not target_unit and not target_city:
+            return True
+        elif target_unit:
+            return target_unit.civ == self.civ and target_unit._type != self._type
+        elif target_city:
+            return target_city.civ == self.civ
+
 
 class SettlerUnit(Unit):
     def __init__(self, name, **kwargs):
@@ -120,6 +143,11 @@ class WorkerUnit(Unit):
 
     def actions(self, game):
         out = (['move'] if self.get_moves(game) else [])
+        out += self.build_actions(game)
+        return out
+
+    def build_actions(self, game):
+        out = []
         if self.moves > 0:
             tile = game.board[self.pos]
             civ = game.get_civ(tile)
@@ -182,16 +210,10 @@ class CombatUnit(Unit):
     def get_targets(self, game):
         out = []
         range_ = getattr(self, 'range', 1)
+        maps = game.influence_maps()
         for tile in civutils.neighbors(self.pos, game.board, range_):
             if not (self.attack == 'melee' and self.moves < tile.moves):
-                target_unit = game.get_unit(tile)
-                target_city = game.get_city(tile)
-                if game.get_unit(tile):
-                    target_civ = getattr(game.get_unit(tile), 'civ', None)
-                elif game.get_city(tile):
-                    target_civ = getattr(game.get_city(tile), 'civ', None)
-                else:
-                    target_civ = None
+                target_civ = maps.occupant_civ(tile.pos)
                 if target_civ is not None and target_civ != self.civ:
                     out.append(tile)
         return out
@@ -220,9 +242,11 @@ class CombatUnit(Unit):
             self.hp = min(100, self.hp + int(hp))
 
     def update_exp(self, exp=1):
+        # True if the unit leveled up
         self.exp += int(exp)
         cost = civutils.level_cost(self.level)
         if self.exp >= cost:
-            print("{} leveled up".format(self.name))
             self.exp = 0
-            self.level += 1
\ No newline at end of file
+            self.level += 1
+            return True
+        return False
\ No newline at end of file
@@ -2,8 +2,8 @@ import random
 import string
 import math
 import multiprocessing as mp
+import heapq
 import numpy as np
-from queue import PriorityQueue
 
 
 NEIGHBOR_DX = {
@@ -15,11 +15,13 @@ NEIGHBOR_DY = [1, 1, 0, -1, -1, 0]
 
 class Action:
 
-    def __init__(self, name, city=None, unit=None, target=None):
+    def __init__(self, name, city=None, unit=None, target=None, path=None):
         self.name = name
         self.city = city
         self.unit = unit
         self.target = target
+        # Optional path to target for 'goto', if the caller already has one
+        self.path = path
 
 
 def tiles_in_range(pos, r, shape):
@@ -65,6 +67,18 @@ def neighbors(pos, board, r=1):
     return out
 
 
+def copy_state(obj):
+    # New instance of obj's class sharing its attributes, except that list
+    # attributes are copied so appends and removals don't leak between the two
+    out = obj.__class__.__new__(obj.__class__)
+    state = obj.__dict__.copy()
+    for k, v in state.items():
+        if type(v) is list:
+            state[k] = v[:]
+    out.__dict__ = state
+    return out
+
+
 def create_path(start, end, xmax, wrap=False, max_iter=100):
     if wrap:
         if end[0] < start[0]:
@@ -104,43 +118,117 @@ def calc_path_moves(path, board):
     return sum(board[p].moves for p in path[1:])
 
 
-def find_best_path(start, goal, game):
-    unit = game.get_unit(game.board[start])
-    class PriorityEntry(object):
-        def __init__(self, priority, data):
-            self.data = data
-            self.priority = priority
-        def __lt__(self, other):
-            return self.priority < other.priority
-    frontier = PriorityQueue()
-    frontier.put(PriorityEntry(0, start))
-    came_from = {}
-    cost_so_far = {}
-    came_from[start] = None
-    cost_so_far[start] = 0
-    while not frontier.empty():
-        current = frontier.get()
-        if current.data == goal:
+def unit_map(game):
+    # Position -> the unit game.get_unit would return there (combat units first)
+    out = {}
+    for civ in game.civs:
+        for unit in civ.units:
+            current = out.get(unit.pos)
+            if current is None or (current._type != 'combat' and unit._type == 'combat'):
+                out[unit.pos] = unit
+    return out
+
+
+def search(start, game, goal=None, max_cost=None, units=None):
+    # dijkstra on the game's board, stopping early at goal
+    board = game.board
+    if units is None:
+        units = unit_map(game)
+    units = {pos: (unit.civ, unit._type) for pos, unit in units.items()}
+    goals = ([goal] if goal is not None else [])
+    return dijkstra(start, board.shape, lambda pos: board[pos].moves, units, goals=goals, max_cost=max_cost)
+
+
+def dijkstra(start, shape, moves, units, goals=(), max_cost=None):
+    # Dijkstra over move costs from start. Entering a tile costs moves(pos),
+    # plus 100 if it holds a foreign unit or a friendly unit of the same type
+    # as the unit on the start tile, units mapping positions to the (civ,
+    # type) of the unit there. Stops once every goal is reached, if any are
+    # given, and does not expand tiles costing more than max_cost.
+    xmax = shape[0] - 1
+    height = shape[1]
+    unit = units.get(start)
+    came_from = {start: None}
+    cost_so_far = {start: 0}
+    frontier = [(0, start)]
+    remaining = set(goals)
+    while frontier:
+        cost, current = heapq.heappop(frontier)
+        if cost > cost_so_far[current]:
+            continue
+        if remaining:
+            remaining.discard(current)
+            if not remaining:
+                break
+        if max_cost is not None and cost > max_cost:
             break
         for i in range(6):
-            nb = neighbor(current.data, i, game.board.shape[0] - 1)
-            if game.board.contains(nb):
-                nb_cost = game.board[nb].moves
-                nb_unit = game.get_unit(game.board[nb])
-                if unit is not None and nb_unit is not None:
-                    if unit.civ != nb_unit.civ or unit._type == nb_unit._type:
+            nb = neighbor(current, i, xmax)
+            if 0 <= nb[1] < height:
+                nb_cost = moves(nb)
+                if unit is not None:
+                    nb_unit = units.get(nb)
+                    if nb_unit is not None and (unit[0] != nb_unit[0] or unit[1] == nb_unit[1]):
                         nb_cost += 100
-                new_cost = cost_so_far[current.data] + nb_cost
+                new_cost = cost + nb_cost
                 if nb not in cost_so_far or new_cost < cost_so_far[nb]:
                     cost_so_far[nb] = new_cost
-                    priority = new_cost
-                    frontier.put(PriorityEntry(new_cost, nb))
-                    came_from[nb] = current.data
+                    came_from[nb] = current
+                    heapq.heappush(frontier, (new_cost, nb))
+    return came_from, cost_so_far
+
+
+def settler_score(pos, civ, shape, owner, is_city, yields, resources):
+    # Worth of settling pos for civ: nothing if another civ owns it or a city
+    # lies within 3 tiles, else its yields plus those of its unowned
+    # neighbours, doubled where they have resources. owner(p) gives the civ
+    # owning a position or None, and is_city(p), yields(p) and resources(p)
+    # whether a city is centred there, its summed yields and whether it has
+    # resources, so Game and analysis.Snapshot can share the rule.
+    tile_civ = owner(pos)
+    if tile_civ is not None and tile_civ != civ:
+        return 0
+    if any(is_city(nb) for nb in tiles_in_range(pos, 3, shape)):
+        return 0
+    total = yields(pos)
+    for nb in tiles_in_range(pos, 1, shape):
+        if owner(nb) is not None:
+            continue
+        elif resources(nb):
+            total += 2 * yields(nb)
+        else:
+            total += yields(nb)
+    return total
+
+
+def worker_score(pos, civ, owner, is_city, improvable, yields, resources):
+    # Worth of improving pos for civ: its yields, doubled if it has
+    # resources, if civ owns it, no city is centred there and an improvement
+    # can be built (arguments as for settler_score)
+    if owner(pos) == civ and not is_city(pos) and improvable(pos):
+        if resources(pos):
+            return 2 * yields(pos)
+        return yields(pos)
+    return 0
+
+
+def trace_path(came_from, goal):
     path = [goal]
-    while path[-1] != start:
+    while came_from[path[-1]] is not None:
         path.append(came_from[path[-1]])
-    path = path[::-1]
-    return path, cost_so_far
+    return path[::-1]
+
+
+def find_best_path(start, goal, game):
+    with game.stats.timer('pathfinding'):
+        came_from, cost_so_far = search(start, game, goal=goal)
+        return trace_path(came_from, goal), cost_so_far
+
+
+def find_paths(start, game, max_cost=None):
+    # Search tree from start, for answering many path queries from one origin
+    with game.stats.timer('pathfinding'):
+        return search(start, game, max_cost=max_cost)
 
 
 def distance(pos1, pos2, xsize):
@@ -0,0 +1,134 @@
+import zlib
+
+MASK = (1 << 64) - 1
+# Feature keys are derived on demand and memoized; past this many the memo is
+# dropped and rebuilt
+MAX_KEYS = 1000000
+
+_keys = {}
+
+
+def mix(x):
+    # splitmix64 finalizer
+    x = (x + 0x9E3779B97F4A7C15) & MASK
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK
+    return x ^ (x >> 31)
+
+
+def key(*feature):
+    # 64-bit key for a tuple of strings, ints and None. Keys depend only on
+    # the feature, not on the process or the Python version, so hashes can be
+    # compared between runs.
+    k = _keys.get(feature)
+    if k is None:
+        k = 0
+        for x in feature:
+            if x is None:
+                x = MASK
+            elif isinstance(x, str):
+                x = zlib.crc32(x.encode())
+            k = mix(k ^ (int(x) & MASK))
+        if len(_keys) >= MAX_KEYS:
+            _keys.clear()
+        _keys[feature] = k
+    return k
+
+
+def tile_hash(tile):
+    x, y = tile.pos
+    out = 0
+    for f in tile.features:
+        out ^= key('feature', x, y, f)
+    for i in tile.improvements:
+        out ^= key('improvement', x, y, i)
+    return out
+
+
+def unit_hash(unit):
+    x, y = unit.pos
+    gx, gy = (unit.order.goal if unit.order is not None else (None, None))
+    return key('unit', unit.civ, unit._class, x, y, unit.moves, getattr(unit, 'hp', 0), getattr(unit, 'fortified', False), getattr(unit, 'builds', 0), gx, gy)
+
+
+def city_hash(city):
+    x, y = city.pos
+    return key(
+        'city', city.civ, x, y, city.prod, int(city.prod_progress), city.hp, city.pp, int(city.pp_progress),
+        int(city.tile_progress), city.moves, len(city.tiles), len(city.buildings)
+    )
+
+
+def counter_hash(turn, active):
+    return key('turn', turn) ^ key('active', active)
+
+
+def full_hash(game):
+    out = counter_hash(game.turn, game.active)
+    for tile in game.board:
+        out ^= tile_hash(tile)
+    for civ in game.civs:
+        for unit in civ.units:
+            out ^= unit_hash(unit)
+        for city in civ:
+            out ^= city_hash(city)
+    return out
+
+
+class Rehash:
+    # Scope around a game mutation that updates game.zobrist by XORing out
+    # the hashes of the listed objects before the mutation and XORing in
+    # their hashes after. civs stands for all of their units and cities, and
+    # units that no longer belong to their civ afterwards count as removed.
+    # Scopes nest, and only the outermost one updates the hash, so it must
+    # cover everything the inner ones do. Every scope records its tiles as
+    # touched (see Game.touch_tiles).
+    __slots__ = ('game', 'units', 'cities', 'tiles', 'civs', 'counters', 'before')
+
+    def __init__(self, game, units=(), cities=(), tiles=(), civs=(), counters=False):
+        self.game = game
+        self.units = units
+        self.cities = cities
+        self.tiles = tiles
+        self.civs = civs
+        self.counters = counters
+
+    def __enter__(self):
+        self.game._rehash_depth += 1
+        if self.game._rehash_depth == 1:
+            self.before = self.value()
+        return self
+
+    def __exit__(self, *exc):
+        tiles = [t for t in self.tiles if t is not None]
+        if tiles:
+            self.game.touch_tiles(tiles)
+        if self.game._rehash_depth == 1:
+            self.game.zobrist ^= self.before ^ self.value()
+        self.game._rehash_depth -= 1
+        return False
+
+    def value(self):
+        # Each object once, however many of the lists it is in
+        game = self.game
+        units = {}
+        cities = {}
+        for civ in self.civs:
+            for unit in civ.units:
+                units[id(unit)] = unit
+            for city in civ:
+                cities[id(city)] = city
+        for unit in self.units:
+            if unit is not None and unit in game.find_civ(unit.civ).units:
+                units[id(unit)] = unit
+        for city in self.cities:
+            if city is not None:
+                cities[id(city)] = city
+        out = (counter_hash(game.turn, game.active) if self.counters else 0)
+        for unit in units.values():
+            out ^= unit_hash(unit)
+        for city in cities.values():
+            out ^= city_hash(city)
+        for tile in set(t for t in self.tiles if t is not None):
+            out ^= tile_hash(tile)
+        return out